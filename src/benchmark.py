@@ -0,0 +1,246 @@
+#!/usr/bin/env python
+
+# Benchmark suite on synthetic libraries.
+#
+#   python benchmark.py --cells 50 --pins 40 --bus-widths 8,64 --corners 4 -o results.json
+#   python benchmark.py ... --compare results.json
+#
+# Writes a synthetic library and corners JSON to a scratch directory and
+# times each phase separately:
+#
+#   read       read_library_json (parse, validate, build the Library)
+#   characterize  Library.characterize for every corner
+#   emit       Library.emit_to for every corner, into a null sink
+#   write_all  Library.write_all from a freshly read library
+#
+# With numpy installed it also checks that the numpy and pure Python table
+# resampling paths give identical values, and exits with 1 if they don't.
+#
+# For each phase it reports wall time, peak RSS of the process so far and
+# the number of characterizer calls (calls made in worker processes with
+# --workers > 1 are not counted). Results can be saved as JSON and compared
+# against an earlier run.
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import resource
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, here)
+import dotlibber
+
+def synthetic_corner(i, constraint_index, delay_index):
+    step = 0.0001 * (i + 1)
+    voltage = 0.7 + 0.05 * i
+    return {
+        "name" : "corner%d" % i,
+        "process" : 1,
+        "temperature" : -40 + 25 * i,
+        "nominal_voltage" : voltage,
+        "voltage_map" : { "VDD" : voltage, "VSS" : 0.0 },
+        "constraint_template" : {
+            "related_pin_transition" : [step * (k + 1) for k in range(constraint_index)],
+            "constrained_pin_transition" : [step * (k + 1) for k in range(constraint_index)]
+        },
+        "delay_template" : {
+            "input_net_transition" : [step * (k + 1) for k in range(delay_index)],
+            "total_output_net_capacitance" : [0.001 * (k + 1) for k in range(delay_index)]
+        }
+    }
+
+def synthetic_corners(n_corners, constraint_index, delay_index):
+    return [synthetic_corner(i, constraint_index, delay_index) for i in range(n_corners)]
+
+# Every other sequential input is a bus, cycling through bus_widths. A width
+# of 1 means plain pins only.
+def synthetic_cell(i, n_pins, bus_widths):
+    pins = [{
+        "name" : "clk",
+        "direction" : "input",
+        "clock" : True
+    }]
+    n_bus = 0
+    for k in range(n_pins):
+        name = "d%d" % k
+        if k % 2 == 0:
+            width = bus_widths[n_bus % len(bus_widths)]
+            n_bus += 1
+            if width > 1:
+                name = "%s[%d:0]" % (name, width - 1)
+        pins.append({
+            "name" : name,
+            "direction" : "input",
+            "sequential" : True,
+            "related_clock" : "clk"
+        })
+        pins.append({
+            "name" : "q%d" % k,
+            "direction" : "output",
+            "sequential" : True,
+            "related_clock" : "clk"
+        })
+    return {
+        "name" : "cell%d" % i,
+        "defaults" : {
+            "capacitance" : 0.01,
+            "max_transition" : 0.2,
+            "max_capacitance" : 0.5,
+            "related_power_pin" : "VDD",
+            "related_ground_pin" : "VSS"
+        },
+        "pg_pins" : [
+            { "name" : "VDD", "pg_type" : "primary_power" },
+            { "name" : "VSS", "pg_type" : "primary_ground" }
+        ],
+        "pins" : pins
+    }
+
+def synthetic_library(n_cells, n_pins, bus_widths):
+    return {
+        "name" : "synthetic",
+        "revision" : 0,
+        "cells" : [synthetic_cell(i, n_pins, bus_widths) for i in range(n_cells)]
+    }
+
+# Characterizer with a call counter; cheap so the phases measure dotlibber
+counter = {"calls": 0}
+def counting_characterizer(arc_type, timing_type, pin, related_pin, corner, params):
+    counter["calls"] += 1
+    return 0.001 * len(pin.name) + sum(params.values())
+
+class NullWriter:
+
+    def __init__(self):
+        self.count = 0
+
+    def write(self, s):
+        self.count += len(s)
+
+# Resample tables between finer and coarser grids through both the numpy and
+# the pure Python path, which must give identical values. None without numpy.
+def check_resampling(args):
+    if dotlibber.numpy is None:
+        return None
+    def grid(name, n, step):
+        index = [step * (k + 1) ** 1.5 for k in range(n)]
+        return dotlibber.LUTTemplate(name, "input_net_transition", index, "total_output_net_capacitance", [0.5 * x for x in index])
+    for n_src, n_dst in ((args.delay_index, args.delay_index + 3), (args.delay_index + 3, args.delay_index), (args.constraint_index, 1)):
+        src = grid("src%d" % n_src, n_src, 0.01)
+        dst = grid("dst%d" % n_dst, n_dst, 0.013)
+        values = dotlibber.array.array("d", (1.0 + i * 0.37 + (i % 7) * 1.3 for i in range(src.len1 * src.len2)))
+        r = dotlibber.Resampler(src, dst)
+        if r.resample_numpy(values) != r.resample_python(values):
+            return False
+    return True
+
+def peak_rss_mb():
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kB on Linux, bytes on macOS
+    return rss / 1e6 if sys.platform == "darwin" else rss / 1e3
+
+def timed(results, name, func):
+    calls = counter["calls"]
+    start = time.perf_counter()
+    value = func()
+    results[name] = {
+        "wall_s": time.perf_counter() - start,
+        "peak_rss_mb": peak_rss_mb(),
+        "characterizer_calls": counter["calls"] - calls
+    }
+    return value
+
+def run(args, scratch):
+    bus_widths = [int(x) for x in args.bus_widths.split(",")]
+    libfile = os.path.join(scratch, "library.json")
+    cornerfile = os.path.join(scratch, "corners.json")
+    with open(libfile, "w") as fp:
+        json.dump(synthetic_library(args.cells, args.pins, bus_widths), fp)
+    with open(cornerfile, "w") as fp:
+        json.dump({"corners": synthetic_corners(args.corners, args.constraint_index, args.delay_index)}, fp)
+
+    phases = {}
+    lib = timed(phases, "read", lambda: dotlibber.read_library_json(libfile, cornerfile, characterizer=counting_characterizer))
+    lib.float_format = dotlibber.FloatFormat(args.float_format)
+    timed(phases, "characterize", lambda: [lib.characterize(c) for c in lib.corners])
+    sink = NullWriter()
+    timed(phases, "emit", lambda: [lib.emit_to(sink, c) for c in lib.corners])
+    phases["emit"]["bytes"] = sink.count
+    del lib
+
+    lib = dotlibber.read_library_json(libfile, cornerfile, characterizer=counting_characterizer)
+    lib.float_format = dotlibber.FloatFormat(args.float_format)
+    outdir = os.path.join(scratch, "output")
+    timed(phases, "write_all", lambda: lib.write_all(lambda lib, corner: os.path.join(outdir, corner.name + ".lib"), workers=args.workers, stream=True, compression=args.compress))
+    phases["write_all"]["bytes"] = sum(os.path.getsize(os.path.join(outdir, f)) for f in os.listdir(outdir))
+    phases["resample"] = {"numpy_matches_python": check_resampling(args)}
+    return phases
+
+def report(phases, baseline=None):
+    print("%-14s %10s %12s %14s%s" % ("phase", "wall (s)", "peak RSS MB", "char. calls", "  vs baseline" if baseline else ""))
+    for name, r in phases.items():
+        if "wall_s" not in r:
+            continue
+        line = "%-14s %10.3f %12.1f %14d" % (name, r["wall_s"], r["peak_rss_mb"], r["characterizer_calls"])
+        if baseline and name in baseline:
+            line += "  %6.2fx" % (baseline[name]["wall_s"] / r["wall_s"] if r["wall_s"] > 0 else float("inf"))
+        print(line)
+    if "bytes" in phases.get("emit", {}):
+        print("emit: %.1f MB, %.1f MB/s" % (phases["emit"]["bytes"] / 1e6, phases["emit"]["bytes"] / phases["emit"]["wall_s"] / 1e6))
+    if "bytes" in phases.get("write_all", {}):
+        print("write_all: %.1f MB on disk" % (phases["write_all"]["bytes"] / 1e6))
+    parity = phases.get("resample", {}).get("numpy_matches_python")
+    if parity is not None:
+        print("resample: numpy and pure Python %s" % ("match" if parity else "DIFFER"))
+
+def main():
+    parser = argparse.ArgumentParser(description="Time dotlibber phases on a synthetic library.")
+    parser.add_argument("--cells", type=int, default=50)
+    parser.add_argument("--pins", type=int, default=40, help="sequential input/output pin pairs per cell")
+    parser.add_argument("--bus-widths", default="64", help="comma separated widths cycled over the bus pins")
+    parser.add_argument("--corners", type=int, default=2)
+    parser.add_argument("--constraint-index", type=int, default=3, help="constraint template size (N x N)")
+    parser.add_argument("--delay-index", type=int, default=8, help="delay template size (N x N)")
+    parser.add_argument("--workers", type=int, default=1, help="workers for the write_all phase")
+    parser.add_argument("--compress", choices=["gzip", "zstd"], default=None, help="compression for the write_all phase")
+    parser.add_argument("--float-format", default=None, help="printf style format of table values, e.g. %%.6g")
+    parser.add_argument("-o", "--output", default=None, help="save results to this JSON file")
+    parser.add_argument("--compare", default=None, help="JSON results of an earlier run to compare against")
+    parser.add_argument("--keep", action="store_true", help="keep the scratch directory")
+    args = parser.parse_args()
+
+    scratch = tempfile.mkdtemp(prefix="dotlibber_bench_")
+    try:
+        phases = run(args, scratch)
+    finally:
+        if args.keep:
+            print("scratch directory: %s" % scratch)
+        else:
+            shutil.rmtree(scratch, ignore_errors=True)
+
+    baseline = None
+    if args.compare is not None:
+        with open(args.compare) as fp:
+            baseline = json.load(fp)["phases"]
+    report(phases, baseline)
+
+    if args.output is not None:
+        results = {
+            "params": vars(args),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "phases": phases
+        }
+        with open(args.output, "w") as fp:
+            json.dump(results, fp, indent=1, sort_keys=True)
+    if phases["resample"]["numpy_matches_python"] is False:
+        exit(1)
+
+if __name__ == "__main__":
+    main()
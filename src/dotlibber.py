@@ -1,14 +1,86 @@
+import gc
+import io
 import os
 import re
+import gzip
 import json
+import mmap
+import struct
 import sys
+import time
+import zlib
+import array
+import bisect
+import asyncio
+import fnmatch
+import inspect
+import sqlite3
+import hashlib
+import weakref
+import itertools
+import argparse
+import contextlib
+import functools
+import concurrent.futures
 from datetime import datetime
 
+# numpy is optional, it is only used to hand index grids to batch characterizers
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# zstandard is optional, only needed for zstd compressed output
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
 # Define how many spaces are in an indentation
 IWIDTH = 4
 
-def to_s(foo):
-    return foo.__str__()
+# Number format of table values and template indices. None keeps the
+# shortest repr that reads back to the same float; otherwise a printf style
+# format such as "%.6g", or an int (or a string of digits, as given on the
+# command line) for that many significant digits. The
+# format strings are built once per table shape so a whole table is
+# formatted by a single % operation.
+class FloatFormat:
+
+    def __init__(self, spec=None):
+        if isinstance(spec, str) and spec.isdigit():
+            spec = int(spec)
+        if isinstance(spec, int):
+            spec = "%%.%dg" % spec
+        if spec is not None:
+            try:
+                spec % 1.0
+            except (TypeError, ValueError):
+                sys.stderr.write("Invalid float format \"%s\". Aborting.\n" % spec)
+                exit(1)
+        self.spec = spec
+        self.formats = {}
+
+    def row(self, values):
+        if self.spec is None:
+            return ", ".join(map(repr, values))
+        n = len(values)
+        fmt = self.formats.get(n)
+        if fmt is None:
+            fmt = self.formats[n] = ", ".join([self.spec] * n)
+        return fmt % tuple(values)
+
+    # len2 quoted rows of len1 values, joined by sep
+    def table(self, values, len1, len2, sep):
+        if self.spec is None:
+            return sep.join(["\"%s\"" % ", ".join(map(repr, values[x2 * len1:(x2 + 1) * len1])) for x2 in range(len2)])
+        key = (len1, len2, sep)
+        fmt = self.formats.get(key)
+        if fmt is None:
+            fmt = self.formats[key] = sep.join(["\"%s\"" % ", ".join([self.spec] * len1)] * len2)
+        return fmt % tuple(values)
+
+default_float_format = FloatFormat()
 
 # Default function to name the .lib, passed to the Library constructor
 def default_library_namer(lib, corner):
@@ -17,11 +89,32 @@ def default_library_namer(lib, corner):
 def default_file_namer(lib, corner):
     return os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), "output", default_library_namer(lib, corner) + ".lib")
 
-default_characterizer_global = 0.0
+# Mark a characterizer as a batch characterizer. Instead of being called once
+# per table entry, it is called once per table with params mapping each
+# template variable to the flattened index grid (index_2 major, index_1 minor)
+# and returns the whole table, either as len(index_2) rows of len(index_1)
+# floats, as a flat list in grid order, or as a float numpy array of either
+# shape. With arrays=True the grid is passed as numpy arrays instead of lists.
+def batch_characterizer(func=None, arrays=False):
+    def mark(f):
+        if arrays and numpy is None:
+            sys.stderr.write("batch_characterizer(arrays=True) requires numpy. Aborting.\n")
+            exit(1)
+        f.batch = "numpy" if arrays else "list"
+        return f
+    if func is None:
+        return mark
+    return mark(func)
+
+# File namer for a given output directory, use with functools.partial
+def output_dir_file_namer(output_dir, lib, corner):
+    return os.path.join(output_dir, default_library_namer(lib, corner) + ".lib")
+
+# Dummy data derived from the arguments alone, so a value doesn't depend on
+# what else was characterized first, or in which thread or process
 def default_characterizer(arc_type, timing_type, pin, related_pin, corner, params):
-    global default_characterizer_global
-    default_characterizer_global += 0.1
-    return default_characterizer_global
+    key = "%s/%s/%s/%s/%s/%s" % (corner.name, pin.cell.name, pin.name, related_pin.name, arc_type, sorted(params.items()))
+    return 0.1 * (1 + zlib.crc32(key.encode()) % 100)
 
 class Corner:
 
@@ -41,60 +134,277 @@ class Corner:
             self.voltage_map[k] = float(self.attr["voltage_map"][k])
         require_key(self, "constraint_template")
         require_key(self, "delay_template")
+        # Optional denser grids the tables are characterized (and cached)
+        # on, then resampled onto the corner's templates. Changing only the
+        # templates' breakpoints then needs no new characterization.
+        self.characterization_templates = {}
         try:
-            x = self.attr["constraint_template"]
-            self.constraint_template = LUTTemplate("constraint_template_%dx%d" % (len(x["related_pin_transition"]),len(x["constrained_pin_transition"])),
-                "related_pin_transition",
-                x["related_pin_transition"],
-                "constrained_pin_transition",
-                x["constrained_pin_transition"])
-            x = self.attr["delay_template"]
-            self.delay_template = LUTTemplate("delay_template_%dx%d" % (len(x["input_net_transition"]),len(x["total_output_net_capacitance"])),
-                "input_net_transition",
-                x["input_net_transition"],
-                "total_output_net_capacitance",
-                x["total_output_net_capacitance"])
+            self.constraint_template = corner_template("constraint_template", self.attr["constraint_template"])
+            self.delay_template = corner_template("delay_template", self.attr["delay_template"])
+            for kind, x in self.attr.get("characterization_templates", {}).items():
+                self.characterization_templates[getattr(self, kind)] = corner_template(kind, x)
         except:
             sys.stderr.write("Error reading LUT templates for corner \"%s\". Aborting.\n" % self.name)
             exit(1)
+        for t in self.characterization_templates.values():
+            for index in (t.index_1, t.index_2):
+                if any(a >= b for a, b in zip(index, index[1:])):
+                    sys.stderr.write("Characterization template %s of corner \"%s\" must have increasing indices. Aborting.\n" % (t.name, self.name))
+                    exit(1)
+
+        # Tables derived from other corners instead of characterized
+        self.derivation = None
+        if "derive" in self.attr:
+            self.derivation = CornerDerivation(self, self.attr["derive"])
+        # Libraries using the corner, told when it changes, see update
+        self.libraries = weakref.WeakSet()
+
+    # Change corner attributes and rebuild the corner in place. Its own and
+    # its derived corners' derivations are resolved again, and every library
+    # using the corner drops the tables and renderings that depend on it.
+    def update(self, attr):
+        if "name" in attr and attr["name"] != self.name:
+            raise Exception("Corner \"%s\" cannot be renamed." % self.name)
+        libraries = self.libraries
+        for lib in libraries:
+            lib.edit()
+        self.attr.update(attr)
+        self.__init__(self.attr, self.characterizer)
+        self.libraries = libraries
+        for lib in libraries:
+            corners = lib.corners + lib.source_corners
+            for c in corners:
+                if c.derivation is not None and (c is self or self in c.ancestors()):
+                    c.derivation = CornerDerivation(c, c.attr["derive"])
+                    c.derivation.resolve([x for x in corners if x is not c and c not in x.ancestors()])
+            break
+        for lib in libraries:
+            lib.invalidate_corner(self)
+
+    # The libraries stay behind when a corner is pickled
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["libraries"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.libraries = weakref.WeakSet()
+
+    # The template tables emitted on template are characterized on
+    def characterization_template(self, template):
+        return self.characterization_templates.get(template, template)
+
+    # Value of process, temperature, voltage (the nominal voltage) or a
+    # voltage_map entry
+    def parameter(self, name):
+        if name == "process":
+            return self.process
+        if name == "temperature":
+            return self.temperature
+        if name == "voltage":
+            return self.voltage
+        return self.voltage_map[name]
+
+    # Corners this corner's tables are derived from, directly or not
+    def ancestors(self):
+        if self.derivation is None:
+            return []
+        corners = []
+        for s in self.derivation.sources:
+            corners += [s] + s.ancestors()
+        return corners
 
     def emit(self):
-        output  = "nom_process : %d;\n" % self.process
-        output += "nom_temperature : %d;\n" % self.temperature
-        output += "nom_voltage : %f;\n" % self.voltage
+        return emit_string(self.emit_to)
+
+    def emit_to(self, fp, lvl=0, fmt=None):
+        p = pad(lvl)
+        p1 = pad(lvl+1)
+        output  = p + "nom_process : %d;\n" % self.process
+        output += p + "nom_temperature : %d;\n" % self.temperature
+        output += p + "nom_voltage : %f;\n" % self.voltage
         for k in self.voltage_map:
-            output += "voltage_map(%s, %f);\n" % (k, self.voltage_map[k])
-        output += "operating_conditions(\"%s\") {\n" % self.name
-        output += indent("process : %d;\n") % self.process
-        output += indent("temperature : %d;\n") % self.temperature
-        output += indent("voltage : %f;\n") % self.voltage
-        output += "}\n"
-        output += "default_operating_conditions : %s;\n" % self.name
-        output += self.constraint_template.emit()
-        output += self.delay_template.emit()
-        return output
+            output += p + "voltage_map(%s, %f);\n" % (k, self.voltage_map[k])
+        output += p + "operating_conditions(\"%s\") {\n" % self.name
+        output += p1 + "process : %d;\n" % self.process
+        output += p1 + "temperature : %d;\n" % self.temperature
+        output += p1 + "voltage : %f;\n" % self.voltage
+        output += p + "}\n"
+        output += p + "default_operating_conditions : %s;\n" % self.name
+        fp.write(output)
+        self.constraint_template.emit_to(fp, lvl, fmt)
+        self.delay_template.emit_to(fp, lvl, fmt)
+
+# Derived corner tables, from "derive" in the corner JSON. Either
+#
+#   {"from": "ss0p80v125c", "model": "derate", "coefficients": {"temperature": 0.002, "VDD": -0.9}}
+#
+# which scales the source corner's tables by 1 + sum(k * (this corner's
+# parameter - the source's)), over any parameter Corner.parameter knows; or
+#
+#   {"from": ["ss0p72v125c", "ss0p88v125c"], "model": "interpolate", "over": "voltage"}
+#
+# which interpolates linearly between the two source corners bracketing
+# this corner's parameter (extrapolating past the ends). Source tables are
+# resampled onto this corner's templates first, and whole tables are
+# combined at once. Sources must be listed before the derived corner.
+class CornerDerivation:
+
+    def __init__(self, corner, attr):
+        self.corner = corner
+        self.attr = attr
+        self.source_names = attr.get("from")
+        if type(self.source_names) == type(""):
+            self.source_names = [self.source_names]
+        self.model = attr.get("model", "derate" if len(self.source_names or []) == 1 else "interpolate")
+        self.sources = []
+        if not self.source_names or self.model not in ("derate", "interpolate"):
+            self.error("needs \"from\" and a model of derate or interpolate")
+        if self.model == "derate":
+            if len(self.source_names) != 1:
+                self.error("derates exactly one corner")
+            self.coefficients = attr.get("coefficients", {})
+            self.parameters = list(self.coefficients.keys())
+        else:
+            if len(self.source_names) < 2 or "over" not in attr:
+                self.error("interpolates over a parameter (\"over\") between two or more corners")
+            self.parameters = [attr["over"]]
+        for name in self.parameters:
+            self.check_parameter(corner, name)
+
+    def error(self, message):
+        sys.stderr.write("Derived corner \"%s\" %s. Aborting.\n" % (self.corner.name, message))
+        exit(1)
+
+    def check_parameter(self, corner, name):
+        if name not in ("process", "temperature", "voltage") and name not in corner.voltage_map:
+            self.error("uses unknown parameter \"%s\" of corner \"%s\"" % (name, corner.name))
+
+    # Look the source corners up among those defined before this one
+    def resolve(self, corners):
+        by_name = dict((c.name, c) for c in corners)
+        for name in self.source_names:
+            if name not in by_name:
+                self.error("needs corner \"%s\" defined before it" % name)
+            for p in self.parameters:
+                self.check_parameter(by_name[name], p)
+            self.sources.append(by_name[name])
+        if self.model == "interpolate":
+            over = self.parameters[0]
+            self.sources.sort(key=lambda c: c.parameter(over))
+            x = [c.parameter(over) for c in self.sources]
+            if any(a == b for a, b in zip(x, x[1:])):
+                self.error("interpolates between corners with the same %s" % over)
+            # The bracketing pair, or the nearest one at the ends
+            k = min(max(bisect.bisect_right(x, self.corner.parameter(over)) - 1, 0), len(x) - 2)
+            self.sources = self.sources[k:k + 2]
+            self.weight = (self.corner.parameter(over) - x[k]) / (x[k + 1] - x[k])
+        else:
+            source = self.sources[0]
+            self.scale = 1.0 + sum(k * (self.corner.parameter(p) - source.parameter(p)) for p, k in self.coefficients.items())
+
+    def table(self, arc_type, timing_type, pin, template, related_pin=None):
+        tables = [source_table(pin, s, timing_type, arc_type, related_pin).resample(template).values for s in self.sources]
+        if self.model == "derate":
+            return DataTable(arc_type, template, scale_values(tables[0], self.scale))
+        return DataTable(arc_type, template, mix_values(tables[0], tables[1], self.weight))
+
+def source_table(pin, corner, timing_type, arc_type, related_pin=None):
+    for arc in pin.get_arcs(corner):
+        if arc.TIMING_TYPE == timing_type and (related_pin is None or arc.related_pin is related_pin):
+            return getattr(arc, arc_type)
+
+def scale_values(values, scale):
+    if numpy is not None:
+        return numpy.frombuffer(values, dtype=float) * scale
+    return array.array("d", [x * scale for x in values])
+
+# a + (b - a) * w, elementwise
+def mix_values(a, b, w):
+    if numpy is not None:
+        a = numpy.frombuffer(a, dtype=float)
+        return a + (numpy.frombuffer(b, dtype=float) - a) * w
+    return array.array("d", [x + (y - x) * w for x, y in zip(a, b)])
 
 class Library:
 
-    def __init__(self, attr, corners, library_namer=default_library_namer, characterizer=default_characterizer, options=None):
+    def __init__(self, attr, corners, library_namer=default_library_namer, characterizer=default_characterizer, options=None, cache=None, bus_bits=False, instrumentation=None, concurrency=16, executor=None, float_format=None, cells=None, corner_names=None, pins=None, keep_rendered=False, share_arcs=False):
         self.attr = attr
+        # Characterize arcs with the same timing type and pin attributes
+        # once per cell, see Cell.expand_arcs
+        self.share_arcs = share_arcs
+        # Keep each cell's rendered group per corner and write it again on
+        # later emits until the cell, its pins or the corner are updated.
+        # Holds a copy of the output in memory.
+        self.keep_rendered = keep_rendered
+        # Counts in place edits. Process pool workers hold a copy of the
+        # library from when the pool was made and must not fall behind it.
+        self.generation = 0
+        # Optional name patterns (see name_selected) that restrict the
+        # library to some cells, corners and pins. Other cells are never
+        # built, other corners are only characterized when a selected one
+        # is derived from them, other pins are dropped from their cells.
+        self.pin_patterns = pins
+        # FloatFormat, or its spec, table values and indices are written with
+        self.float_format = float_format if isinstance(float_format, FloatFormat) else FloatFormat(float_format)
+        # Characterizer calls in flight at once for async characterizers
+        self.concurrency = concurrency
+        # Optional concurrent.futures executor the tables of a corner are
+        # characterized in, see characterize_parallel
+        self.executor = executor
+        # Optional Instrumentation, also enabled through DOTLIBBER_TRACE/DOTLIBBER_SUMMARY
+        self.instrumentation = instrumentation if instrumentation is not None else instrumentation_from_env()
+        # Emit a pin group per bit inside each bus group, sharing the bus's timing tables
+        self.bus_bits = bus_bits
+        # Optional CharacterizationCache consulted before calling the characterizer
+        self.cache = cache
         self.name = get_name(self)
         self.datetime = datetime.now().strftime("%c")
         require_int(self,"revision")
         self.corners = []
         for c in corners:
-            self.add_corner(c, characterizer)
+            if isinstance(c, Corner):
+                # Shared with other libraries (see read_library_batch) and
+                # already resolved
+                self.corners.append(c)
+            else:
+                self.add_corner(c, characterizer)
+        for i, c in enumerate(self.corners):
+            if c.derivation is not None and not c.derivation.sources:
+                c.derivation.resolve(self.corners[:i])
         # Check that all corners have the same voltage names
         for c in self.corners:
             if (set(c.voltage_map.keys()) != set(self.voltage_names())):
                 sys.stderr.write("Error: all corners must have the same voltage names! Aborting.\n")
                 exit(1)
+        # Unselected corners the selected ones are derived from
+        self.source_corners = []
+        if corner_names is not None:
+            selected = [c for c in self.corners if name_selected(c.name, corner_names)]
+            if not selected:
+                sys.stderr.write("Error: no corner matches %s. Aborting.\n" % ", ".join(corner_names))
+                exit(1)
+            needed = set(id(s) for c in selected for s in c.ancestors())
+            self.source_corners = [c for c in self.corners if id(c) in needed and not name_selected(c.name, corner_names)]
+            self.corners = selected
+        for c in self.corners + self.source_corners:
+            c.libraries.add(self)
         require_key(self,"cells")
         self.cells = []
         self.library_namer = library_namer
         self.bus_types = {}
-        for a in self.attr["cells"]:
-            self.add_cell(a, self.bus_types)
+        with gc_paused():
+            for a in self.attr["cells"]:
+                if cells is not None and "name" in a and not name_selected(a["name"], cells):
+                    continue
+                self.add_cell(a, self.bus_types)
+        if cells is not None and not self.cells:
+            sys.stderr.write("Error: no cell of library \"%s\" matches %s. Aborting.\n" % (self.name, ", ".join(cells)))
+            exit(1)
+        if pins is not None and not any(c.pins for c in self.cells):
+            sys.stderr.write("Error: no pin of library \"%s\" matches %s. Aborting.\n" % (self.name, ", ".join(pins)))
+            exit(1)
         # Default configurations
         self.options={'delay_model': 'table_lookup',
                       'simulation': 'true',
@@ -110,6 +420,46 @@ class Library:
     def voltage_names(self):
         return self.corners[0].voltage_map.keys()
 
+    def cell(self, name):
+        for c in self.cells:
+            if c.name == name:
+                return c
+        raise KeyError(name)
+
+    def corner(self, name):
+        for c in self.corners + self.source_corners:
+            if c.name == name:
+                return c
+        raise KeyError(name)
+
+    # Edit the library in place, for what-if loops over one Library. Only
+    # the tables and rendered cells the change touches are characterized
+    # and rendered again on the next emit or write_all, see Cell.update,
+    # Pin.update and Corner.update.
+    def update_cell(self, name, attr):
+        self.cell(name).update(attr)
+
+    # Called by every in-place edit before it changes anything
+    def edit(self):
+        if isinstance(self.executor, concurrent.futures.ProcessPoolExecutor):
+            raise Exception("Library \"%s\" cannot be edited while its executor is a process pool, its workers would keep the old library. Shut it down and create a new one with characterization_process_pool(lib) after editing." % self.name)
+        self.generation += 1
+
+    def update_pin(self, cell_name, pin_name, attr):
+        self.cell(cell_name).pin(pin_name).update(attr)
+
+    def update_corner(self, name, attr):
+        self.corner(name).update(attr)
+
+    # Drop the tables and renderings of corner and the corners derived from it
+    def invalidate_corner(self, corner):
+        stale = [corner] + [c for c in self.corners + self.source_corners if corner in c.ancestors()]
+        for c in self.cells:
+            for s in stale:
+                c.release(s)
+            for key in [k for k in c.rendered if k[0] in stale]:
+                del c.rendered[key]
+
     def add_cell(self, cell_attr, bus_types):
         self.cells.append(Cell(self, cell_attr, bus_types))
 
@@ -117,64 +467,401 @@ class Library:
         self.corners.append(Corner(corner_attr, characterizer))
 
     def emit(self, corner):
-        output  = "library (%s) {\n" % self.library_namer(self, corner)
-        header  = "technology (cmos);\n"
-        header += "date : \"%s\";\n" % self.datetime
-        header += "comment : \"Generated by dotlibber.py\";\n"
-        header += "revision : %s;\n" % self.attr["revision"]
+        return emit_string(self.emit_to, corner)
+
+    # Characterize every cell (or the given cells) for a corner now rather
+    # than on first emit. Async characterizers get every table point of the
+    # corner gathered concurrently, see characterize_async.
+    def characterize(self, corner, cells=None):
+        if cells is None:
+            cells = self.cells
+        if corner.derivation is not None:
+            for s in corner.derivation.sources:
+                self.characterize(s, cells)
+        elif is_async_characterizer(corner.characterizer):
+            # Nothing left after characterize_async, which also spares
+            # callers inside a running event loop the asyncio.run
+            work = self.pending_arcs(corner, cells)
+            if work:
+                asyncio.run(self.characterize_work_async(corner, work))
+            return
+        elif self.executor is not None:
+            self.characterize_parallel(corner, cells)
+            return
+        for c in cells:
+            c.characterize(corner)
+
+    # Whether a corner's tables are characterized for all cells before it is
+    # emitted, rather than cell by cell as they are written
+    def characterized_up_front(self, corner):
+        if corner.derivation is not None:
+            return any(self.characterized_up_front(s) for s in corner.derivation.sources)
+        return self.executor is not None or is_async_characterizer(corner.characterizer)
+
+    # (cell index, index in all_pins, pin, arc spec index, table requests)
+    # for every arc of the given cells still missing for the corner, in emit
+    # order. Arcs sharing another arc's tables request none; the unselected
+    # pins they are characterized as are included.
+    def pending_arcs(self, corner, cells):
+        wanted = set(id(c) for c in cells)
+        work = []
+        for ci, c in enumerate(self.cells):
+            if id(c) not in wanted:
+                continue
+            pins = c.with_representatives([p for p in c.arc_pins if corner not in p.arcs])
+            for pi, p in enumerate(c.all_pins):
+                if p in pins and corner not in p.arcs:
+                    for si, spec in enumerate(p.arc_specs()):
+                        work.append((ci, pi, p, si, spec.table_requests(p, corner)))
+        return work
+
+    # Build the arcs from their tables, given in the order of pending_arcs.
+    # Shared arcs are built last, once the arcs they share with exist.
+    def assemble_arcs(self, corner, work, tables):
+        tables = iter(tables)
+        shared = []
+        for ci, pi, pin, si, reqs in work:
+            spec = pin.arc_specs()[si]
+            arcs = pin.arcs.setdefault(corner, [])
+            if spec.shared is None:
+                arcs.append(spec.make(pin, corner, [next(tables) for r in reqs]))
+            else:
+                arcs.append(None)
+                shared.append((pin, si, spec))
+        for pin, si, spec in shared:
+            pin.arcs[corner][si] = spec.make(pin, corner)
+
+    # Coroutine version of characterize, for callers already running an
+    # event loop. All points of all tables still missing for the corner are
+    # fed to the characterizer by self.concurrency worker tasks, then the
+    # arcs are assembled in pin order.
+    async def characterize_async(self, corner, cells=None):
+        if cells is None:
+            cells = self.cells
+        await self.characterize_work_async(corner, self.pending_arcs(corner, cells))
+
+    async def characterize_work_async(self, corner, work):
+        requests = [r for ci, pi, pin, si, reqs in work for r in reqs]
+        instr = self.instrumentation
+        if instr is None:
+            tables = await characterize_tables_async(requests, self.concurrency)
+        else:
+            with instr.span("characterize", corner.name):
+                tables = await characterize_tables_async(requests, self.concurrency)
+        self.assemble_arcs(corner, work, tables)
+
+    # Characterize the missing tables of a corner in self.executor. Uncached
+    # tables are submitted in chunks of CHARACTERIZE_CHUNK and their values
+    # put back by position, so the arcs come out the same whatever order the
+    # chunks finish in. A ThreadPoolExecutor works as is; a process pool must
+    # come from characterization_process_pool so the workers have the library.
+    def characterize_parallel(self, corner, cells=None):
+        if cells is None:
+            cells = self.cells
+        work = self.pending_arcs(corner, cells)
+        requests = []
+        items = []
+        for ci, pi, pin, si, reqs in work:
+            for k, r in enumerate(reqs):
+                requests.append(r)
+                items.append((ci, pi, si, k))
+        instr = self.instrumentation
+        span = None
+        if instr is not None:
+            span = instr.span("characterize", corner.name)
+            span.__enter__()
+        try:
+            tables, keys = cached_tables(requests)
+            missing = [i for i in range(len(requests)) if tables[i] is None]
+            lib = None if isinstance(self.executor, concurrent.futures.ProcessPoolExecutor) else self
+            corner_index = (self.corners + self.source_corners).index(corner)
+            chunks = [missing[n:n + CHARACTERIZE_CHUNK] for n in range(0, len(missing), CHARACTERIZE_CHUNK)]
+            futures = [self.executor.submit(characterize_chunk_worker, (lib, self.generation, corner_index, [items[i] for i in chunk])) for chunk in chunks]
+            for chunk, future in zip(chunks, futures):
+                for i, values in zip(chunk, future.result()):
+                    arc_type, timing_type, pin, related_pin, template, corner = requests[i]
+                    tables[i] = DataTable(arc_type, template, values)
+                    if keys[i] is not None:
+                        self.cache.put(keys[i], tables[i])
+        finally:
+            if span is not None:
+                span.__exit__(None, None, None)
+        self.assemble_arcs(corner, work, tables)
+
+    # Executors don't pickle; a library handed to worker processes leaves
+    # its executor behind
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["executor"] = None
+        return state
+
+    def release(self, corner):
+        for c in self.cells:
+            c.release(corner)
+
+    # Stream the .lib for one corner to fp, one cell at a time. Arcs are
+    # characterized the first time a corner is emitted; with stream=True each
+    # cell's arcs are dropped again once the cell has been written, so only
+    # one cell's tables are held in memory at a time.
+    #
+    # For incremental writes, sections (a list) receives [cell name, start,
+    # end] character offsets of each cell's group, fp must then be a
+    # CountingWriter. reuse is a SectionReader whose cells are copied from
+    # the previous output instead of being emitted.
+    def emit_to(self, fp, corner, stream=False, sections=None, reuse=None):
+        if self.characterized_up_front(corner):
+            self.characterize(corner, [c for c in self.cells if (reuse is None or not reuse.has(c.name)) and c.render_key(corner, 1) not in c.rendered])
+        p1 = pad(1)
+        fp.write("library (%s) {\n" % self.library_namer(self, corner))
+        header  = p1 + "technology (cmos);\n"
+        header += p1 + "date : \"%s\";\n" % self.datetime
+        header += p1 + "comment : \"Generated by dotlibber.py\";\n"
+        header += p1 + "revision : %s;\n" % self.attr["revision"]
         # Assert that we're only doing NLDM
-        header += "delay_model : %s;\n" % self.options['delay_model']
-        header += "simulation : %s;\n" % self.options['simulation']
+        header += p1 + "delay_model : %s;\n" % self.options['delay_model']
+        header += p1 + "simulation : %s;\n" % self.options['simulation']
         # Unit specifications
-        header += "capacitive_load_unit %s;\n" % self.options['capacitive_load_unit']
-        header += "voltage_unit : \"%s\";\n" % self.options['voltage_unit']
-        header += "current_unit : \"%s\";\n" % self.options['current_unit']
-        header += "time_unit : \"%s\";\n" % self.options['time_unit']
-        header += "pulling_resistance_unit : \"%s\";\n" % self.options['pulling_resistance_unit']
-        header += corner.emit()
-        output += indent(header)
-        output += "\n"
-        output += "\n".join(list(map(lambda kv: kv[1], self.bus_types.items())))
+        header += p1 + "capacitive_load_unit %s;\n" % self.options['capacitive_load_unit']
+        header += p1 + "voltage_unit : \"%s\";\n" % self.options['voltage_unit']
+        header += p1 + "current_unit : \"%s\";\n" % self.options['current_unit']
+        header += p1 + "time_unit : \"%s\";\n" % self.options['time_unit']
+        header += p1 + "pulling_resistance_unit : \"%s\";\n" % self.options['pulling_resistance_unit']
+        fp.write(header)
+        corner.emit_to(fp, 1, self.float_format)
+        fp.write("\n")
+        fp.write("\n".join(list(map(lambda kv: kv[1], self.bus_types.items()))))
         for c in self.cells:
-            output += indent(c.emit(corner))
-            output += "\n"
-
-        output += "}\n"
-        return output
-
-
-    def write_all(self, file_namer=default_file_namer, file_dir=None):
-        for corner in self.corners:
-            if not(file_dir is None):
-                f = os.path.join(file_dir, file_namer(self, corner))
+            if sections is not None:
+                start = fp.count
+            if reuse is not None and reuse.has(c.name):
+                fp.write(reuse.read(c.name))
             else:
-                f = file_namer(self, corner)
-
-            # this is basically mkdir -p
-            try:
-                os.makedirs(os.path.dirname(f))
-            except OSError:
-                pass
-            open(f,"w").write(self.emit(corner))
+                c.emit_to(fp, corner, 1)
+            if sections is not None:
+                sections.append([c.name, start, fp.count])
+            fp.write("\n")
+            if stream:
+                c.release(corner)
+                for s in corner.ancestors():
+                    c.release(s)
+
+        fp.write("}\n")
+
+
+    # Write one .lib per corner. With workers > 1 the corners are emitted in a
+    # process pool; failures are collected and reported per corner, in corner
+    # order, after every corner has been attempted.
+    #
+    # With incremental=True a manifest of input hashes is kept next to the
+    # output (or at manifest=) and corners whose inputs are unchanged since
+    # the last run are not rewritten. incremental="cells" additionally copies
+    # unchanged cells' groups from the previous file and only re-emits the
+    # cells that changed.
+    #
+    # compression="gzip" or "zstd" writes .lib.gz or .lib.zst files,
+    # compressing as the text is emitted; compression_level trades CPU time
+    # for size.
+    #
+    # Returns the totals write_libraries reports for the library.
+    def write_all(self, file_namer=default_file_namer, file_dir=None, workers=1, stream=False, incremental=False, manifest=None, compression=None, compression_level=None):
+        return write_libraries([self], file_namer, file_dir, workers, stream, incremental, manifest, compression, compression_level)[0]
+
+    # Characterize every corner and save the library with all its tables in
+    # the binary format read_binary reads back. With stream=True each cell's
+    # arcs are released once saved.
+    def save(self, path, stream=False):
+        write_binary(self, path, stream)
+
+    def corner_file(self, corner, file_namer=default_file_namer, file_dir=None):
+        if not(file_dir is None):
+            return os.path.join(file_dir, file_namer(self, corner))
+        return file_namer(self, corner)
+
+    # Returns the cell sections when sections is a list, see emit_to.
+    # compression is a (compression, level) pair, see write_all.
+    def write_corner(self, corner, f, stream=False, reuse=None, sections=None, compression=(None, None)):
+        # this is basically mkdir -p
+        try:
+            os.makedirs(os.path.dirname(f))
+        except OSError:
+            pass
+        # Write to a temporary file so a failed corner never leaves a truncated .lib behind
+        tmp = f + ".tmp"
+        span = None
+        if self.instrumentation is not None:
+            span = self.instrumentation.span("write", corner.name)
+            span.__enter__()
+        try:
+            with open_lib(tmp, "w", *compression) as fp:
+                if sections is not None:
+                    fp = CountingWriter(fp)
+                reader = SectionReader(f, reuse, compression[0]) if reuse else None
+                try:
+                    self.emit_to(fp, corner, stream, sections, reader)
+                finally:
+                    if reader is not None:
+                        reader.close()
+            os.replace(tmp, f)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            if span is not None:
+                span.__exit__(None, None, None)
+        return sections
+
+    # Hashes of everything that goes into a corner's .lib: the library level
+    # attributes and header options, the corner, its characterizer, and each
+    # cell's attributes
+    def manifest_entry(self, corner):
+        characterizer = corner.characterizer
+        lib_attr = dict((k, v) for k, v in self.attr.items() if k != "cells")
+        header = [
+            lib_attr,
+            self.options,
+            sorted(self.bus_types.items()),
+            self.library_namer(self, corner),
+            self.bus_bits,
+            self.float_format.spec,
+            self.pin_patterns,
+            self.share_arcs,
+            corner.attr,
+            [s.attr for s in corner.ancestors()],
+            "%s.%s" % (getattr(characterizer, "__module__", ""), getattr(characterizer, "__qualname__", characterizer.__class__.__name__)),
+            str(getattr(characterizer, "version", ""))
+        ]
+        return {
+            "header": hash_json(header),
+            "cells": [[c.name, hash_json(c.attr)] for c in self.cells]
+        }
 
 class LUTTemplate:
 
+    __slots__ = ("name", "var1", "var2", "index_1", "index_2", "twod", "len1", "len2")
+
     def __init__(self, name, var1, index_1, var2=None, index_2=[]):
         self.name = name
         self.var1 = var1
         self.var2 = var2
-        self.index_1 = index_1
-        self.index_2 = index_2
+        self.index_1 = tuple(index_1)
+        self.index_2 = tuple(index_2)
         self.twod = var2 is not None
+        # Table shape: len2 rows of len1 values
+        self.len1 = len(self.index_1)
+        self.len2 = len(self.index_2) if self.twod else 1
+        # Sanity check, done once here rather than for every table
+        for x in self.index_1 + self.index_2:
+            if type(x) != type(0.0):
+                sys.stderr.write("Index values of LUT template \"%s\" must be floats. Aborting.\n" % name)
+                exit(1)
 
     def emit(self):
-        output  = "variable_1 : %s;\n" % self.var1
+        return emit_string(self.emit_to)
+
+    def emit_to(self, fp, lvl=0, fmt=None):
+        fmt = fmt or default_float_format
+        p = pad(lvl)
+        p1 = pad(lvl+1)
+        output  = p + "lu_table_template (%s) {\n" % self.name
+        output += p1 + "variable_1 : %s;\n" % self.var1
+        if self.twod:
+            output += p1 + "variable_2 : %s;\n" % self.var2
+        output += p1 + "index_1 (\"%s\");\n" % fmt.row(self.index_1)
         if self.twod:
-            output += "variable_2 : %s;\n" % self.var2
-        output += "index_1 (\"%s\");\n" % ", ".join(map(to_s, self.index_1))
+            output += p1 + "index_2 (\"%s\");\n" % fmt.row(self.index_2)
+        output += p + "}\n"
+        fp.write(output)
+
+    # Flattened index grid for batch characterizers, see batch_characterizer
+    def grid(self, arrays=False):
+        grid = {self.var1: list(self.index_1) * self.len2}
         if self.twod:
-            output += "index_2 (\"%s\");\n" % ", ".join(map(to_s, self.index_2))
-        return "lu_table_template (%s) {\n" % self.name + indent(output) + "}\n"
+            grid[self.var2] = [x for x in self.index_2 for i in range(self.len1)]
+        if arrays:
+            for k in grid:
+                grid[k] = numpy.array(grid[k], dtype=float)
+        return grid
+
+# Identical templates (e.g. the same grid in several corners) share one object
+lut_templates = {}
+def lut_template(name, var1, index_1, var2=None, index_2=[]):
+    key = (name, var1, tuple(index_1), var2, tuple(index_2))
+    if key not in lut_templates:
+        lut_templates[key] = LUTTemplate(name, var1, index_1, var2, index_2)
+    return lut_templates[key]
+
+# Variables of the two templates a corner defines
+TEMPLATE_VARIABLES = {
+    "constraint_template": ("related_pin_transition", "constrained_pin_transition"),
+    "delay_template": ("input_net_transition", "total_output_net_capacitance")
+}
+
+def corner_template(kind, x):
+    var1, var2 = TEMPLATE_VARIABLES[kind]
+    return lut_template("%s_%dx%d" % (kind, len(x[var1]), len(x[var2])), var1, x[var1], var2, x[var2])
+
+# For each point of dst, (i, j, w) such that its value is
+# src[i] + (src[j] - src[i]) * w. Points on the src grid take its value
+# exactly, points outside extrapolate linearly from the nearest segment.
+def interpolation_weights(src, dst):
+    if len(src) == 1:
+        return [(0, 0, 0.0) for x in dst]
+    weights = []
+    for x in dst:
+        k = bisect.bisect_right(src, x) - 1
+        if k >= 0 and src[k] == x:
+            weights.append((k, k, 0.0))
+            continue
+        k = min(max(k, 0), len(src) - 2)
+        weights.append((k, k + 1, (x - src[k]) / (src[k + 1] - src[k])))
+    return weights
+
+# Bilinear resampling of tables from one template's grid onto another's.
+# The weights are worked out once per pair of templates; with numpy a
+# table is resampled in a few array operations.
+class Resampler:
+
+    def __init__(self, src, dst):
+        self.src = src
+        self.dst = dst
+        self.w1 = interpolation_weights(src.index_1, dst.index_1)
+        self.w2 = interpolation_weights(src.index_2, dst.index_2) if dst.twod else [(0, 0, 0.0)]
+        if numpy is not None:
+            self.i1, self.j1, self.f1 = [numpy.array(x) for x in zip(*self.w1)]
+            self.i2, self.j2, self.f2 = [numpy.array(x) for x in zip(*self.w2)]
+
+    def resample(self, values):
+        if numpy is not None:
+            return self.resample_numpy(values)
+        return self.resample_python(values)
+
+    def resample_numpy(self, values):
+        v = numpy.frombuffer(values, dtype=float).reshape(self.src.len2, self.src.len1)
+        # Same operations as resample_python, so the results are identical
+        a = v[self.i2]
+        rows = a + (v[self.j2] - a) * self.f2[:, None]
+        a = rows[:, self.i1]
+        out = array.array("d")
+        out.frombytes((a + (rows[:, self.j1] - a) * self.f1).tobytes())
+        return out
+
+    def resample_python(self, values):
+        len1 = self.src.len1
+        out = array.array("d")
+        for i2, j2, f2 in self.w2:
+            a = values[i2 * len1:(i2 + 1) * len1]
+            b = values[j2 * len1:(j2 + 1) * len1]
+            row = [x + (y - x) * f2 for x, y in zip(a, b)]
+            out.extend(row[i] + (row[j] - row[i]) * f for i, j, f in self.w1)
+        return out
+
+resamplers = {}
+def resampler(src, dst):
+    key = (src, dst)
+    if key not in resamplers:
+        resamplers[key] = Resampler(src, dst)
+    return resamplers[key]
+
+BUS_RE = re.compile(r"^([\w_]+)[\[<](\d+):(\d+)[\]>]$")
 
 class Cell:
 
@@ -188,14 +875,21 @@ class Cell:
         self.pins = []
         self.clocks = {}
         self.sequential_pins = []
+        # Pins with timing arcs, sequential or declared in "timing"
+        self.arc_pins = []
+        # Rendered cell groups by render_key, with lib.keep_rendered
+        self.rendered = {}
         self.defaults = {}
         if ("defaults" in self.attr.keys()):
             self.defaults = self.attr["defaults"]
         for p in self.attr["pg_pins"]:
             self.add_pg_pin(p)
+        # Looked up by every pin, so only build these once
+        self.power_pin_names = [x.name for x in self.power_pins()]
+        self.ground_pin_names = [x.name for x in self.ground_pins()]
         for p in self.attr["pins"]:
             ###matches bus defined with [upper:lower] and <upper:lower>
-            m = re.match(r"^([\w_]+)[\[<](\d+):(\d+)[\]>]$", p["name"]) if "name" in p.keys() else False
+            m = BUS_RE.match(p["name"]) if "name" in p else False
 
             ####matches bus defined with [upper:lower]
             #m = re.match(r"^([\w_]+)\[(\d+):(\d+)]$", p["name"]) if "name" in p.keys() else False
@@ -239,9 +933,16 @@ class Cell:
     }\n""" % (upper, lower, upper - lower + 1, upper, lower)
             else:
                 self.add_pin(p)
+        # Arcs are characterized lazily per corner (see characterize), but
+        # check the clock relationships up front
         for p in self.sequential_pins:
-            for c in self.lib.corners:
-                p.generate_arcs(c)
+            p.check_related_clock()
+        # Unselected pins stay reachable as related pins through all_pins
+        self.all_pins = self.pins
+        if lib.pin_patterns is not None:
+            self.pins = [p for p in self.pins if name_selected(p.name, lib.pin_patterns)]
+            self.sequential_pins = [p for p in self.sequential_pins if name_selected(p.name, lib.pin_patterns)]
+            self.arc_pins = [p for p in self.arc_pins if name_selected(p.name, lib.pin_patterns)]
 
     def power_pins(self):
         return filter(lambda x: x.type == "primary_power", self.pg_pins)
@@ -252,6 +953,22 @@ class Cell:
     def add_pg_pin(self, pg_pin_attr):
         self.pg_pins.append(PGPin(self, pg_pin_attr))
 
+    def pin(self, name):
+        for p in self.pins:
+            if p.name == name:
+                return p
+        raise KeyError(name)
+
+    # Change cell attributes, e.g. "defaults" or the "pins" list, and
+    # rebuild the cell in place. All its arcs are characterized and the
+    # cell rendered again on the next emit; other cells are untouched.
+    def update(self, attr):
+        if "name" in attr and attr["name"] != self.name:
+            raise Exception("Cell \"%s\" cannot be renamed." % self.name)
+        self.lib.edit()
+        self.attr.update(attr)
+        self.__init__(self.lib, self.attr, self.lib.bus_types)
+
     def add_pin(self, pin_attr):
         self.pins.append(Pin(self, pin_attr, self.defaults))
 
@@ -264,17 +981,124 @@ class Cell:
     def add_sequential_pin(self, pin):
         self.sequential_pins.append(pin)
 
+    def add_arc_pin(self, pin):
+        self.arc_pins.append(pin)
+
+    # The pin an arc of pin is related to: a clock for sequential arcs, an
+    # input for combinational ones
+    def related_pin(self, name, arc_class, pin):
+        if arc_class is CombinationalArc:
+            for p in self.all_pins:
+                if p.name == name and p.direction == "input":
+                    return p
+            kind = "an input"
+        else:
+            if name in self.clocks:
+                return self.clocks[name]
+            kind = "a clock"
+        sys.stderr.write("Related pin \"%s\" of the %s arc of pin \"%s\" of cell \"%s\" is not %s pin. Aborting.\n" % (name, arc_class.TIMING_TYPE, pin.name, self.name, kind))
+        exit(1)
+
+    # Expand the declared arcs of every pin (see Pin.declared_arcs) and
+    # work out which arcs share their tables. An arc with characterize_as
+    # shares those of the arc it names. With lib.share_arcs any other arc
+    # shares those of the first arc in the cell with the same timing type
+    # and sense whose pin and related pin have the same attributes but for
+    # their names, across pins, clocks and bus widths. That assumes the
+    # characterizer doesn't tell pins apart by name. Tables are then
+    # characterized once per distinct arc rather than per pin and clock.
+    def expand_arcs(self):
+        specs = []
+        for p in self.all_pins:
+            p.specs = p.declared_arcs() if p.has_arcs else []
+            specs += [(p, i, s) for i, s in enumerate(p.specs)]
+        by_arc = {}
+        for p, i, s in specs:
+            by_arc.setdefault((p.name, s.arc_class, s.related_pin.name), (p, i))
+        for p, i, s in specs:
+            if s.characterize_as is not None:
+                target = s.characterize_as if type(s.characterize_as) == type({}) else {"pin": s.characterize_as}
+                key = (target.get("pin", p.name), s.arc_class, target.get("related_pin", s.related_pin.name))
+                if key not in by_arc:
+                    sys.stderr.write("The %s arc of pin \"%s\" of cell \"%s\" is characterized as that of pin \"%s\" related to \"%s\", which has no such arc. Aborting.\n" % (s.arc_class.TIMING_TYPE, p.name, self.name, key[0], key[2]))
+                    exit(1)
+                if by_arc[key] != (p, i):
+                    s.shared = by_arc[key]
+        if self.lib.share_arcs:
+            groups = {}
+            for p, i, s in specs:
+                if s.shared is None:
+                    key = (s.arc_class, s.timing_sense, p.signature(), s.related_pin.signature())
+                    if key in groups:
+                        s.shared = groups[key]
+                    else:
+                        groups[key] = (p, i)
+        # Share with the end of the chain, so every shared arc refers to
+        # one that is characterized
+        for p, i, s in specs:
+            hops = 0
+            while s.shared is not None and s.shared[0].specs[s.shared[1]].shared is not None:
+                s.shared = s.shared[0].specs[s.shared[1]].shared
+                hops += 1
+                if hops > len(specs):
+                    sys.stderr.write("The characterize_as of the %s arc of pin \"%s\" of cell \"%s\" is circular. Aborting.\n" % (s.arc_class.TIMING_TYPE, p.name, self.name))
+                    exit(1)
+
+    # pins and the unselected pins whose arcs theirs share tables with
+    def with_representatives(self, pins):
+        pins = list(pins)
+        for p in pins:
+            for spec in p.arc_specs():
+                if spec.shared is not None and spec.shared[0] not in pins:
+                    pins.append(spec.shared[0])
+        return pins
+
+    def characterize(self, corner):
+        for p in self.arc_pins:
+            p.get_arcs(corner)
+
+    # Also unselected pins, which hold arcs that selected ones share
+    def release(self, corner):
+        for p in self.all_pins:
+            p.release_arcs(corner)
+
     def emit(self, corner):
-        output  = "cell (%s) {\n" % self.name
+        return emit_string(self.emit_to, corner)
+
+    def render_key(self, corner, lvl):
+        return (corner, lvl, self.lib.float_format, self.lib.bus_bits)
+
+    def emit_to(self, fp, corner, lvl=0):
+        if not self.lib.keep_rendered:
+            return self.render_to(fp, corner, lvl)
+        key = self.render_key(corner, lvl)
+        if key not in self.rendered:
+            self.rendered[key] = emit_string(self.render_to, corner, lvl)
+        fp.write(self.rendered[key])
+
+    def render_to(self, fp, corner, lvl=0):
+        instr = self.lib.instrumentation
+        if instr is None:
+            return self.emit_group_to(fp, corner, lvl)
+        # Characterize up front so the two phases are timed separately
+        with instr.span("characterize", corner.name, self.name):
+            self.characterize(corner)
+        with instr.span("emit", corner.name, self.name):
+            self.emit_group_to(fp, corner, lvl)
+
+    def emit_group_to(self, fp, corner, lvl=0):
+        p = pad(lvl)
+        p1 = pad(lvl+1)
+        output  = p + "cell (%s) {\n" % self.name
         # For now, always dont_touch, dont_use macros. We aren't using this for std cells.
-        output += indent("dont_use : true;\n")
-        output += indent("dont_touch : true;\n")
-        output += indent("is_macro_cell : true;\n")
-        for p in self.pg_pins + self.pins:
-            output += "\n"
-            output += indent(p.emit(corner))
-        output += "}\n"
-        return output
+        output += p1 + "dont_use : true;\n"
+        output += p1 + "dont_touch : true;\n"
+        output += p1 + "is_macro_cell : true;\n"
+        fp.write(output)
+        for pin in self.pg_pins + self.pins:
+            fp.write("\n")
+            pin.emit_to(fp, corner, lvl+1)
+        fp.write(p + "}\n")
 
 class Pin:
 
@@ -282,9 +1106,14 @@ class Pin:
         self.cell = cell
         self.attr = attr
         self.name = get_name(self)
+        # Timing arcs per corner, filled in lazily by get_arcs
         self.arcs = {}
-        for c in self.cell.lib.corners:
-            self.arcs[c] = []
+        # ArcSpecs of the arcs, see Cell.expand_arcs
+        self.specs = None
+        self.sequential = False
+        self.related_clock_name = None
+        self.related_clock_names = []
+        self.timing = []
         # Use a list here to enforce an ordering
         self.output_attr = []
         self.bus_attr = []
@@ -312,10 +1141,14 @@ class Pin:
                 self.sequential = require_boolean(self, "sequential", False)
                 if self.sequential:
                     require_key(self, "related_clock")
-                    self.related_clock_name = self.attr["related_clock"]
+                    # One clock or a list of them
+                    names = self.attr["related_clock"]
+                    self.related_clock_names = names if type(names) == type([]) else [names]
+                    self.related_clock_name = self.related_clock_names[0]
+                    self.clock_edge = optional_values(self, "clock_edge", list(CLOCK_EDGES.keys()), "rising")
                     self.cell.add_sequential_pin(self)
-                else:
-                    self.related_clock_name = None
+            # Arcs declared beyond those of a sequential pin, see declared_arcs
+            self.timing = self.attr.get("timing", [])
 
             if self.direction == "inout":
                 sys.stderr.write("Digital inout pins are not supported. FIXME. Aborting\n")
@@ -329,9 +1162,9 @@ class Pin:
                 self.output_attr.append(("max_capacitance", require_float(self, "max_capacitance", defaults)))
 
             # Assert that we must have a power pin with the name in our PG pin list
-            related_power_pin = ("related_power_pin",require_values(self, "related_power_pin", map(lambda x: x.name, self.cell.power_pins()), defaults))
+            related_power_pin = ("related_power_pin",require_values(self, "related_power_pin", self.cell.power_pin_names, defaults))
             # Assert that we must have a ground pin with the name in our PG pin list
-            related_ground_pin = ("related_ground_pin",require_values(self, "related_ground_pin", map(lambda x: x.name, self.cell.ground_pins()), defaults))
+            related_ground_pin = ("related_ground_pin",require_values(self, "related_ground_pin", self.cell.ground_pin_names, defaults))
             if self.is_bus:
                 self.bus_attr.append(related_power_pin)
                 self.bus_attr.append(related_ground_pin)
@@ -340,6 +1173,33 @@ class Pin:
                 self.output_attr.append(related_ground_pin)
         else:
             self.output_attr.append(("is_analog", "true"))
+        self.has_arcs = self.sequential or len(self.timing) > 0
+        if self.has_arcs:
+            self.cell.add_arc_pin(self)
+
+    # Change pin attributes and rebuild the pin in place. Its arcs, and
+    # those of the pins it is the related clock of, are characterized again
+    # on the next emit; the pin's cell is rendered again.
+    def update(self, attr):
+        for k in ("name", "is_bus", "bus_max", "bus_min"):
+            if k in attr and attr[k] != self.attr.get(k):
+                raise Exception("Pin \"%s\" of cell \"%s\" cannot change %s, update the cell's pins instead." % (self.name, self.cell.name, k))
+        cell = self.cell
+        cell.lib.edit()
+        if cell.clocks.get(self.name) is self:
+            del cell.clocks[self.name]
+        for p in cell.all_pins:
+            if p.specs is not None and any(s.related_pin is self or (s.shared is not None and s.shared[0] is self) for s in p.specs):
+                p.arcs = {}
+        self.attr.update(attr)
+        self.__init__(cell, self.attr, cell.defaults)
+        cell.sequential_pins = [p for p in cell.pins if p.sequential]
+        cell.arc_pins = [p for p in cell.pins if p.has_arcs]
+        for p in cell.all_pins:
+            p.specs = None
+        if self.sequential:
+            self.check_related_clock()
+        cell.rendered.clear()
 
     def get_related_clock(self):
         if self.related_clock_name is not None:
@@ -348,142 +1208,625 @@ class Pin:
     def has_attr(self, attr):
         return attr in self.attr.keys()
 
-    def generate_arcs(self, corner):
-        if self.related_clock_name not in self.cell.clocks.keys():
-            sys.stderr.write("Related clock pin \"%s\" of pin \"%s\" of cell \"%s\" is not defined as a clock. Please give it the \"clock : true\" attribute. Aborting.\n" % (self.related_clock_name, self.name, self.cell.name))
-            exit(1)
+    def check_related_clock(self):
+        for name in self.related_clock_names:
+            if name not in self.cell.clocks.keys():
+                sys.stderr.write("Related clock pin \"%s\" of pin \"%s\" of cell \"%s\" is not defined as a clock. Please give it the \"clock : true\" attribute. Aborting.\n" % (name, self.name, self.cell.name))
+                exit(1)
+
+    # Attributes arcs are told apart by when sharing them, see
+    # Cell.expand_arcs
+    def signature(self):
+        return tuple(x for x in self.output_attr + self.bus_attr if x[0] != "bus_type")
+
+    def arc_specs(self):
+        if self.specs is None:
+            self.cell.expand_arcs()
+        return self.specs
+
+    # ArcSpecs of the pin's arcs in emit order: for a sequential pin, its
+    # arcs per related clock and clock edge, then one per related pin of
+    # each entry of "timing", e.g.
+    #
+    #   "timing": [{"timing_type": "combinational", "related_pin": ["a", "b"], "timing_sense": "positive_unate"},
+    #              {"timing_type": "falling_edge", "related_pin": "clk2", "characterize_as": {"pin": "q0"}}]
+    #
+    # characterize_as (on an entry, or a pin name on the pin for all its
+    # arcs) names the pin, and optionally the related pin, whose arc of the
+    # same timing type this one shares its tables with.
+    def declared_arcs(self):
+        specs = []
+        characterize_as = self.attr.get("characterize_as")
+        if self.sequential:
+            self.check_related_clock()
+            for name in self.related_clock_names:
+                for edge in CLOCK_EDGES[self.clock_edge]:
+                    for arc_class in self.arc_classes(edge):
+                        specs.append(ArcSpec(arc_class, self.cell.get_clock(name), None, characterize_as))
+        for t in self.timing:
+            arc_class = TIMING_ARC_CLASSES.get(t.get("timing_type"))
+            if arc_class is None:
+                sys.stderr.write("Invalid timing_type \"%s\" of pin \"%s\" of cell \"%s\". Allowed values are %s. Aborting.\n" % (t.get("timing_type"), self.name, self.cell.name, ", ".join(TIMING_ARC_CLASSES.keys())))
+                exit(1)
+            names = t.get("related_pin", [])
+            for name in names if type(names) == type([]) else [names]:
+                specs.append(ArcSpec(arc_class, self.cell.related_pin(name, arc_class, self), t.get("timing_sense"), t.get("characterize_as", characterize_as)))
+        seen = set()
+        for s in specs:
+            if (s.arc_class, s.related_pin) in seen:
+                sys.stderr.write("Pin \"%s\" of cell \"%s\" has more than one %s arc related to \"%s\". Aborting.\n" % (self.name, self.cell.name, s.arc_class.TIMING_TYPE, s.related_pin.name))
+                exit(1)
+            seen.add((s.arc_class, s.related_pin))
+        return specs
+
+    def get_arcs(self, corner):
+        if corner not in self.arcs:
+            self.arcs[corner] = self.generate_arcs(corner) if self.has_arcs else []
+        return self.arcs[corner]
+
+    def release_arcs(self, corner):
+        self.arcs.pop(corner, None)
+
+    def arc_classes(self, edge="rising"):
+        if self.direction in ("input", "output"):
+            return SEQUENTIAL_ARC_CLASSES[(self.direction, edge)]
         else:
-            if self.direction == "input":
-                self.arcs[corner].append(SetupArc(self, self.get_related_clock(), corner))
-                self.arcs[corner].append(HoldArc(self, self.get_related_clock(), corner))
-            elif self.direction == "output":
-                self.arcs[corner].append(ClockToQArc(self, self.get_related_clock(), corner))
-            else:
-                raise Exception("Should not get here, fix me. You have an inout sequential pin, or something else went wrong.")
+            raise Exception("Should not get here, fix me. You have an inout sequential pin, or something else went wrong.")
+
+    # Arcs sharing tables are built after the ones they share them with
+    def generate_arcs(self, corner):
+        specs = self.arc_specs()
+        arcs = self.arcs[corner] = [None] * len(specs)
+        for i, spec in enumerate(specs):
+            if spec.shared is None:
+                arcs[i] = self.make_arc(spec, corner)
+        for i, spec in enumerate(specs):
+            if spec.shared is not None:
+                arcs[i] = self.make_arc(spec, corner)
+        return arcs
+
+    def make_arc(self, spec, corner):
+        instr = self.cell.lib.instrumentation
+        if instr is None:
+            return spec.make(self, corner)
+        with instr.span("arc", corner.name, self.cell.name, spec.arc_class.__name__):
+            return spec.make(self, corner)
 
     def emit(self, corner):
-        attributes = "".join(map(lambda x: "%s : %s;\n" % (x[0], x[1]), self.output_attr))
-        bus_attributes = "".join(map(lambda x: "%s : %s;\n" % (x[0], x[1]), self.bus_attr))
+        return emit_string(self.emit_to, corner)
+
+    def emit_to(self, fp, corner, lvl=0):
+        p = pad(lvl)
+        p1 = pad(lvl+1)
+        p2 = pad(lvl+2)
         # TODO some attributes are corner-specific (cap, max_cap, etc.) and need to be characterized
-        for a in self.arcs[corner]:
-            attributes += a.emit()
         if self.is_bus:
-            output = "bus ( %s ) {\n" % self.name + indent(attributes) + "\n"
-            output += indent("pin ( %s[%d:%d] ) {\n" % (self.name, self.bus_max, self.bus_min) + indent(bus_attributes) + "}\n") + "}\n"
+            output = p + "bus ( %s ) {\n" % self.name
         else:
-            output = "pin (%s) {\n" % self.name + indent(attributes) + "}\n"
-        return output
+            output = p + "pin (%s) {\n" % self.name
+        output += "".join(map(lambda x: "%s%s : %s;\n" % (p1, x[0], x[1]), self.output_attr))
+        fp.write(output)
+        if self.is_bus and self.cell.lib.bus_bits:
+            self.emit_bits_to(fp, corner, lvl)
+            return
+        for a in self.get_arcs(corner):
+            a.emit_to(fp, lvl+1, self.cell.lib.float_format)
+        if self.is_bus:
+            output  = "\n"
+            output += p1 + "pin ( %s[%d:%d] ) {\n" % (self.name, self.bus_max, self.bus_min)
+            output += "".join(map(lambda x: "%s%s : %s;\n" % (p2, x[0], x[1]), self.bus_attr))
+            output += p1 + "}\n"
+            fp.write(output)
+        fp.write(p + "}\n")
+
+    # Per-bit pin groups inside the bus group. Every bit shares the arcs
+    # characterized for the bus as a whole, so the timing groups are
+    # rendered once and written out for each bit.
+    def emit_bits_to(self, fp, corner, lvl):
+        p1 = pad(lvl+1)
+        bit_attributes = "".join(map(lambda x: "%s%s : %s;\n" % (pad(lvl+2), x[0], x[1]), self.bus_attr))
+        timing = io.StringIO()
+        for a in self.get_arcs(corner):
+            a.emit_to(timing, lvl+2, self.cell.lib.float_format)
+        bit_attributes += timing.getvalue()
+        for bit in range(self.bus_max, self.bus_min - 1, -1):
+            fp.write("\n" + p1 + "pin ( %s[%d] ) {\n" % (self.name, bit) + bit_attributes + p1 + "}\n")
+        fp.write(pad(lvl) + "}\n")
+
+# Each arc class lists its tables, timing type and the corner template they
+# are characterized on. An arc is built either by characterizing its tables
+# directly, or from tables filled in elsewhere (tables, in TABLES order) for
+# the corner-wide characterization paths.
+# Tables are requested on the corner's characterization template and
+# resampled onto the one they are emitted on.
+def arc_table_requests(arc_class, pin, related_pin, corner):
+    template = corner.characterization_template(getattr(corner, arc_class.TEMPLATE))
+    return [(name, arc_class.TIMING_TYPE, pin, related_pin, template, corner) for name in arc_class.TABLES]
+
+def init_arc(arc, pin, related_pin, corner, tables):
+    arc.pin = pin
+    arc.related_pin = related_pin
+    if tables is None:
+        tables = [generate_data_table(*r) for r in arc_table_requests(arc.__class__, pin, related_pin, corner)]
+    template = getattr(corner, arc.TEMPLATE)
+    for name, table in zip(arc.TABLES, tables):
+        setattr(arc, name, table.resample(template))
 
 class SetupArc:
 
-    def __init__(self, pin, related_pin, corner):
-        self.pin = pin
-        self.related_pin = related_pin
-        self.rise_constraint = generate_data_table("rise_constraint", "setup_rising", pin, related_pin, corner.constraint_template, corner)
-        self.fall_constraint = generate_data_table("fall_constraint", "setup_rising", pin, related_pin, corner.constraint_template, corner)
+    TIMING_TYPE = "setup_rising"
+    TEMPLATE = "constraint_template"
+    TABLES = ("rise_constraint", "fall_constraint")
+
+    def __init__(self, pin, related_pin, corner, tables=None):
+        init_arc(self, pin, related_pin, corner, tables)
+
+    @classmethod
+    def table_requests(cls, pin, related_pin, corner):
+        return arc_table_requests(cls, pin, related_pin, corner)
 
     def emit(self):
-        output  = "related_pin : \"%s\";\n" % self.related_pin.name
-        # Note that we only support rising clocks for now
-        output += "timing_type : setup_rising;\n"
-        output += self.rise_constraint.emit()
-        output += self.fall_constraint.emit()
-        return "timing () {\n" + indent(output) + "}\n"
+        return emit_string(self.emit_to)
+
+    def emit_to(self, fp, lvl=0, fmt=None):
+        p1 = pad(lvl+1)
+        output  = pad(lvl) + "timing () {\n"
+        output += p1 + "related_pin : \"%s\";\n" % self.related_pin.name
+        output += p1 + "timing_type : %s;\n" % self.TIMING_TYPE
+        fp.write(output)
+        self.rise_constraint.emit_to(fp, lvl+1, fmt)
+        self.fall_constraint.emit_to(fp, lvl+1, fmt)
+        fp.write(pad(lvl) + "}\n")
 
 class HoldArc:
 
-    def __init__(self, pin, related_pin, corner):
-        self.pin = pin
-        self.related_pin = related_pin
-        self.rise_constraint = generate_data_table("rise_constraint", "hold_rising", pin, related_pin, corner.constraint_template, corner)
-        self.fall_constraint = generate_data_table("fall_constraint", "hold_rising", pin, related_pin, corner.constraint_template, corner)
+    TIMING_TYPE = "hold_rising"
+    TEMPLATE = "constraint_template"
+    TABLES = ("rise_constraint", "fall_constraint")
+
+    def __init__(self, pin, related_pin, corner, tables=None):
+        init_arc(self, pin, related_pin, corner, tables)
+
+    @classmethod
+    def table_requests(cls, pin, related_pin, corner):
+        return arc_table_requests(cls, pin, related_pin, corner)
 
     def emit(self):
-        output  = "related_pin : \"%s\";\n" % self.related_pin.name
-        # Note that we only support rising clocks for now
-        output += "timing_type : hold_rising;\n"
-        output += self.rise_constraint.emit()
-        output += self.fall_constraint.emit()
-        return "timing () {\n" + indent(output) + "}\n"
+        return emit_string(self.emit_to)
+
+    def emit_to(self, fp, lvl=0, fmt=None):
+        p1 = pad(lvl+1)
+        output  = pad(lvl) + "timing () {\n"
+        output += p1 + "related_pin : \"%s\";\n" % self.related_pin.name
+        output += p1 + "timing_type : %s;\n" % self.TIMING_TYPE
+        fp.write(output)
+        self.rise_constraint.emit_to(fp, lvl+1, fmt)
+        self.fall_constraint.emit_to(fp, lvl+1, fmt)
+        fp.write(pad(lvl) + "}\n")
 
 class ClockToQArc:
 
-    def __init__(self, pin, related_pin, corner):
-        self.pin = pin
-        self.related_pin = related_pin
-        self.cell_rise = generate_data_table("cell_rise", "rising_edge", pin, related_pin, corner.delay_template, corner)
-        self.cell_fall = generate_data_table("cell_fall", "rising_edge", pin, related_pin, corner.delay_template, corner)
-        self.rise_transition = generate_data_table("rise_transition", "rising_edge", pin, related_pin, corner.delay_template, corner)
-        self.fall_transition = generate_data_table("fall_transition", "rising_edge", pin, related_pin, corner.delay_template, corner)
+    TIMING_TYPE = "rising_edge"
+    TEMPLATE = "delay_template"
+    TABLES = ("cell_rise", "cell_fall", "rise_transition", "fall_transition")
+
+    def __init__(self, pin, related_pin, corner, tables=None, timing_sense="non_unate"):
+        init_arc(self, pin, related_pin, corner, tables)
+        self.timing_sense = timing_sense
+
+    @classmethod
+    def table_requests(cls, pin, related_pin, corner):
+        return arc_table_requests(cls, pin, related_pin, corner)
 
     def emit(self):
-        output  = "related_pin : \"%s\";\n" % self.related_pin.name
-        output += "timing_sense : non_unate;\n"
-        # Note that we only support rising clocks for now
-        output += "timing_type : rising_edge;\n"
-        output += self.cell_rise.emit()
-        output += self.rise_transition.emit()
-        output += self.cell_fall.emit()
-        output += self.fall_transition.emit()
-        return "timing () {\n" + indent(output) + "}\n"
+        return emit_string(self.emit_to)
+
+    def emit_to(self, fp, lvl=0, fmt=None):
+        p1 = pad(lvl+1)
+        output  = pad(lvl) + "timing () {\n"
+        output += p1 + "related_pin : \"%s\";\n" % self.related_pin.name
+        output += p1 + "timing_sense : %s;\n" % self.timing_sense
+        output += p1 + "timing_type : %s;\n" % self.TIMING_TYPE
+        fp.write(output)
+        self.cell_rise.emit_to(fp, lvl+1, fmt)
+        self.rise_transition.emit_to(fp, lvl+1, fmt)
+        self.cell_fall.emit_to(fp, lvl+1, fmt)
+        self.fall_transition.emit_to(fp, lvl+1, fmt)
+        fp.write(pad(lvl) + "}\n")
+
+class SetupFallingArc(SetupArc):
+
+    TIMING_TYPE = "setup_falling"
+
+class HoldFallingArc(HoldArc):
+
+    TIMING_TYPE = "hold_falling"
+
+class ClockToQFallingArc(ClockToQArc):
+
+    TIMING_TYPE = "falling_edge"
+
+class CombinationalArc(ClockToQArc):
+
+    TIMING_TYPE = "combinational"
+
+TIMING_ARC_CLASSES = dict((c.TIMING_TYPE, c) for c in (SetupArc, SetupFallingArc, HoldArc, HoldFallingArc, ClockToQArc, ClockToQFallingArc, CombinationalArc))
+TIMING_SENSES = ["positive_unate", "negative_unate", "non_unate"]
+
+# Arc classes of a sequential pin per clock edge, in emit order
+SEQUENTIAL_ARC_CLASSES = {
+    ("input", "rising"): [SetupArc, HoldArc],
+    ("input", "falling"): [SetupFallingArc, HoldFallingArc],
+    ("output", "rising"): [ClockToQArc],
+    ("output", "falling"): [ClockToQFallingArc],
+}
+CLOCK_EDGES = {"rising": ["rising"], "falling": ["falling"], "both": ["rising", "falling"]}
+
+# One timing arc of a pin, before it is characterized for a corner. shared
+# is (pin, index into its arc specs) of the arc whose tables this one
+# reuses instead of being characterized itself, see Cell.expand_arcs.
+class ArcSpec:
+
+    __slots__ = ("arc_class", "related_pin", "timing_sense", "characterize_as", "shared")
+
+    def __init__(self, arc_class, related_pin, timing_sense=None, characterize_as=None):
+        self.arc_class = arc_class
+        self.related_pin = related_pin
+        self.timing_sense = timing_sense or "non_unate"
+        self.characterize_as = characterize_as
+        self.shared = None
+
+    def table_requests(self, pin, corner):
+        if self.shared is not None:
+            return []
+        return self.arc_class.table_requests(pin, self.related_pin, corner)
+
+    def make(self, pin, corner, tables=None):
+        if self.shared is not None:
+            rep_pin, index = self.shared
+            rep = rep_pin.get_arcs(corner)[index]
+            tables = [getattr(rep, name) for name in self.arc_class.TABLES]
+        if self.arc_class.TEMPLATE == "delay_template":
+            return self.arc_class(pin, self.related_pin, corner, tables, self.timing_sense)
+        return self.arc_class(pin, self.related_pin, corner, tables)
 
 def generate_data_table(arc_type, timing_type, pin, related_pin, template, corner):
-    len1 = len(template.index_1)
-    len2 = len(template.index_2) if template.twod else 1
-    data = [[None for i in range(len1)] for j in range(len2)]
+    if corner.derivation is not None:
+        return corner.derivation.table(arc_type, timing_type, pin, template, related_pin)
+    cache = pin.cell.lib.cache
+    if cache is None:
+        return timed_characterize_table(arc_type, timing_type, pin, related_pin, template, corner)
+    key = cache.key(arc_type, timing_type, pin, related_pin, template, corner)
+    data = cache.get(key)
+    if data is not None:
+        return DataTable(arc_type, template, data)
+    table = timed_characterize_table(arc_type, timing_type, pin, related_pin, template, corner)
+    cache.put(key, table)
+    return table
+
+def timed_characterize_table(arc_type, timing_type, pin, related_pin, template, corner):
+    instr = pin.cell.lib.instrumentation
+    if instr is None:
+        return characterize_table(arc_type, timing_type, pin, related_pin, template, corner)
+    # One per table, too many for the trace; only counted in the summary
+    with instr.span("characterizer", corner.name, pin.cell.name, None, False):
+        return characterize_table(arc_type, timing_type, pin, related_pin, template, corner)
+
+def characterize_table(arc_type, timing_type, pin, related_pin, template, corner):
+    if is_async_characterizer(corner.characterizer):
+        return asyncio.run(characterize_tables_async([(arc_type, timing_type, pin, related_pin, template, corner)], 1))[0]
+    batch = getattr(corner.characterizer, "batch", None)
+    if batch:
+        params = template.grid(batch == "numpy")
+        return DataTable(arc_type, template, corner.characterizer(arc_type, timing_type, pin, related_pin, corner, params))
+    data = []
     params = {}
-    for x2 in range(len2):
-        for x1 in range(len1):
+    for x2 in range(template.len2):
+        for x1 in range(template.len1):
             params[template.var1] = template.index_1[x1]
             if template.twod:
                 params[template.var2] = template.index_2[x2]
-            data[x2][x1] = corner.characterizer(arc_type, timing_type, pin, related_pin, corner, params)
+            data.append(corner.characterizer(arc_type, timing_type, pin, related_pin, corner, params))
     return DataTable(arc_type, template, data)
 
+# Look the table requests up in their library's cache. Returns the tables
+# found (None where missing) and the cache keys (None without a cache).
+def cached_tables(requests):
+    tables = [None] * len(requests)
+    keys = [None] * len(requests)
+    for i, (arc_type, timing_type, pin, related_pin, template, corner) in enumerate(requests):
+        cache = pin.cell.lib.cache
+        if cache is not None:
+            keys[i] = cache.key(arc_type, timing_type, pin, related_pin, template, corner)
+            data = cache.get(keys[i])
+            if data is not None:
+                tables[i] = DataTable(arc_type, template, data)
+    return tables, keys
+
+def is_async_characterizer(characterizer):
+    return inspect.iscoroutinefunction(characterizer) or inspect.iscoroutinefunction(getattr(characterizer, "__call__", None))
+
+# Fill the tables for a list of (arc_type, timing_type, pin, related_pin,
+# template, corner) requests with an async characterizer. Cached tables are
+# taken from the cache; every remaining table point (or whole table, for a
+# batch characterizer) becomes one characterizer call, and concurrency
+# worker tasks keep that many calls in flight. Returns the DataTables in
+# request order.
+async def characterize_tables_async(requests, concurrency):
+    tables, keys = cached_tables(requests)
+    values = {}
+    calls = []
+    for i, (arc_type, timing_type, pin, related_pin, template, corner) in enumerate(requests):
+        if tables[i] is not None:
+            continue
+        if getattr(corner.characterizer, "batch", None):
+            values[i] = None
+            calls.append((i, None, template.grid(corner.characterizer.batch == "numpy")))
+            continue
+        values[i] = [None] * (template.len1 * template.len2)
+        for x2 in range(template.len2):
+            for x1 in range(template.len1):
+                params = {template.var1: template.index_1[x1]}
+                if template.twod:
+                    params[template.var2] = template.index_2[x2]
+                calls.append((i, x2 * template.len1 + x1, params))
+
+    pending = iter(calls)
+    async def worker():
+        for i, point, params in pending:
+            arc_type, timing_type, pin, related_pin, template, corner = requests[i]
+            value = await corner.characterizer(arc_type, timing_type, pin, related_pin, corner, params)
+            if point is None:
+                values[i] = value
+            else:
+                values[i][point] = value
+    await asyncio.gather(*[worker() for n in range(max(1, min(concurrency or 1, len(calls))))])
+
+    for i in values:
+        arc_type, timing_type, pin, related_pin, template, corner = requests[i]
+        tables[i] = DataTable(arc_type, template, values[i])
+        if keys[i] is not None:
+            pin.cell.lib.cache.put(keys[i], tables[i])
+    return tables
+
+# Values are stored flat in an array('d'), row by row (len2 rows of len1
+# values), and interned in table_pool so tables with identical contents share
+# one buffer.
 class DataTable:
 
+    __slots__ = ("name", "template", "values")
+
     def __init__(self, name, template, data):
         self.name = name
         self.template = template
-        self.index_1 = template.index_1
-        self.index_2 = template.index_2
-        self.twod = template.twod
-        # Sanity check
-        for x in self.index_1 + self.index_2:
-            if type(x) != type(0.0):
-                raise
-        if self.twod:
-            self.data = data
-            # Sanity check dimensions and floats
-            if len(self.data) != len(self.index_2):
-                raise
-            for x2 in range(len(self.index_2)):
-                if len(self.data[x2]) != len(self.index_2):
-                    raise
-                for x1 in range(len(self.index_1)):
-                    if type(data[x2][x1]) != type(0.0):
-                        raise
-        else:
-            self.data = data
-            # Sanity check dimensions and floats
-            if len(self.data[0]) != len(self.index_1):
-                raise
-            if len(self.data) != 1:
-                raise
-            for x1 in range(len(self.index_1)):
-                if type(data[0][x1]) != type(0.0):
-                    raise
+        values = table_values(data, template.len1, template.len2)
+        # Sanity check dimensions
+        if len(values) != template.len1 * template.len2:
+            raise Exception("Table %s (%s) has %d values, expected %d." % (name, template.name, len(values), template.len1 * template.len2))
+        # Views into a binary library file are already shared
+        self.values = values if isinstance(values, memoryview) else table_pool.intern(values)
+
+    @property
+    def index_1(self):
+        return self.template.index_1
+
+    @property
+    def index_2(self):
+        return self.template.index_2
+
+    @property
+    def twod(self):
+        return self.template.twod
+
+    # Views into a mapped file don't pickle, copies of them do
+    def __reduce__(self):
+        values = self.values
+        if isinstance(values, memoryview):
+            values = array.array("d", values)
+        return (DataTable, (self.name, self.template, values))
+
+    # The table on another template's grid, by bilinear interpolation
+    def resample(self, template):
+        if template is self.template:
+            return self
+        return DataTable(self.name, template, resampler(self.template, template).resample(self.values))
+
+    # Rows as lists, the layout batch characterizers return
+    @property
+    def data(self):
+        return [row.tolist() for row in self.rows()]
+
+    def rows(self):
+        len1 = self.template.len1
+        return [self.values[x2 * len1:(x2 + 1) * len1] for x2 in range(self.template.len2)]
 
     def emit(self):
-        output  = "%s (%s) {\n" % (self.name, self.template.name)
-        output += indent("index_1 (\"%s\");\n" % ", ".join(map(to_s, self.index_1)))
+        return emit_string(self.emit_to)
+
+    def emit_to(self, fp, lvl=0, fmt=None):
+        fmt = fmt or default_float_format
+        p = pad(lvl)
+        p1 = pad(lvl+1)
+        p2 = pad(lvl+2)
+        template = self.template
+        output  = p + "%s (%s) {\n" % (self.name, template.name)
+        output += p1 + "index_1 (\"%s\");\n" % fmt.row(self.index_1)
         if self.twod:
-            output += indent("index_2 (\"%s\");\n" % ", ".join(map(to_s, self.index_2)))
-        output += indent("values ( \\\n")
-        output += indent(", \\\n".join(map(lambda y: "\"" + ", ".join(map(to_s, y)) + "\"", self.data)) + " \\\n",2)
-        output += indent(");\n")
-        output += "}\n"
-        return output
+            output += p1 + "index_2 (\"%s\");\n" % fmt.row(self.index_2)
+        output += p1 + "values ( \\\n"
+        output += p2 + fmt.table(self.values, template.len1, template.len2, ", \\\n" + p2) + " \\\n"
+        output += p1 + ");\n"
+        output += p + "}\n"
+        fp.write(output)
+
+# Convert the table shapes a characterizer may return (array('d'), numpy
+# array, flat list in grid order, or len2 rows of len1 floats) into a flat
+# array('d'). Converting to 'd' is the type check: anything that isn't a
+# number raises TypeError. Float memoryviews (see BinaryTables) are kept.
+def table_values(data, len1, len2):
+    if isinstance(data, array.array) and data.typecode == "d":
+        return data
+    if isinstance(data, memoryview) and data.format == "d":
+        return data
+    if hasattr(data, "shape"):
+        if data.dtype.kind != "f" or data.size != len1 * len2:
+            raise Exception("Expected a float array with %d entries, got %s of shape %s." % (len1 * len2, data.dtype, data.shape))
+        values = array.array("d")
+        values.frombytes(data.astype("float64").tobytes())
+        return values
+    if len(data) > 0 and isinstance(data[0], (list, tuple, array.array)):
+        if len(data) != len2 or any(len(row) != len1 for row in data):
+            raise Exception("Expected %d rows of %d values." % (len2, len1))
+        return array.array("d", itertools.chain.from_iterable(data))
+    return array.array("d", data)
+
+# Hash-consing pool for table values: a new table whose values match a live
+# table's reuses that table's buffer. Held weakly, so buffers are freed along
+# with the last table using them.
+class TablePool:
+
+    def __init__(self):
+        self.values = weakref.WeakValueDictionary()
+
+    def intern(self, values):
+        key = (len(values), hash(values.tobytes()))
+        shared = self.values.get(key)
+        if shared is not None and shared == values:
+            return shared
+        if shared is None:
+            self.values[key] = values
+        return values
+
+table_pool = TablePool()
+
+# Puts between recounts of the cached bytes, and entries evicted per query
+CACHE_RECOUNT = 1024
+CACHE_EVICT_BATCH = 64
+
+# Persistent on-disk cache of characterized tables, stored in SQLite. Tables
+# are keyed by cell, pin and related pin (their names and attributes, with
+# the cell defaults they pick up), arc and timing type, the characterizer
+# (its qualified name plus the user supplied version), the corner's
+# attributes other than its templates, and the template the table is
+# characterized on. Entries from other versions are dropped on open, and the
+# least recently used entries are evicted once the table data exceeds
+# max_bytes.
+class CharacterizationCache:
+
+    def __init__(self, path, max_bytes=None, version=None):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.version = "" if version is None else str(version)
+        self.hits = 0
+        self.misses = 0
+        self.conn = None
+        self.pid = None
+        # Running count of cached bytes for max_bytes, see put
+        self.total = None
+        self.puts = 0
+        self.invalidate(keep_version=self.version)
+        if max_bytes is not None:
+            self.evict(max_bytes)
+
+    # sqlite connections can't cross fork() or pickling, so each process opens its own
+    def connect(self):
+        if self.conn is None or self.pid != os.getpid():
+            self.conn = sqlite3.connect(self.path, isolation_level=None, timeout=60)
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("PRAGMA synchronous=NORMAL")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS tables (key TEXT PRIMARY KEY, version TEXT, rows INTEGER, data BLOB, size INTEGER, used REAL)")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS tables_used ON tables (used)")
+            self.pid = os.getpid()
+        return self.conn
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["conn"] = None
+        state["pid"] = None
+        return state
+
+    def key(self, arc_type, timing_type, pin, related_pin, template, corner):
+        characterizer = corner.characterizer
+        corner_attr = dict((k, v) for k, v in corner.attr.items() if k not in ("constraint_template", "delay_template", "characterization_templates"))
+        return hashlib.sha256(json.dumps([
+            self.version,
+            getattr(characterizer, "__module__", ""),
+            getattr(characterizer, "__qualname__", characterizer.__class__.__name__),
+            pin.cell.name,
+            pin.name,
+            related_pin.name,
+            pin.attr,
+            pin.signature(),
+            related_pin.attr,
+            related_pin.signature(),
+            arc_type,
+            timing_type,
+            corner_attr,
+            [template.var1, list(template.index_1), template.var2, list(template.index_2)]
+        ], sort_keys=True).encode()).hexdigest()
+
+    def get(self, key):
+        row = self.connect().execute("SELECT rows, data FROM tables WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.connect().execute("UPDATE tables SET used = ? WHERE key = ?", (time.time(), key))
+        values = array.array("d")
+        values.frombytes(row[1])
+        return values
+
+    def put(self, key, table):
+        blob = table.values.tobytes()
+        conn = self.connect()
+        replaced = 0
+        if self.max_bytes is not None:
+            row = conn.execute("SELECT size FROM tables WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                replaced = row[0]
+        conn.execute("INSERT OR REPLACE INTO tables VALUES (?, ?, ?, ?, ?, ?)", (key, self.version, table.template.len2, blob, len(blob), time.time()))
+        if self.max_bytes is not None:
+            # Other processes may share the file, so recount now and then
+            self.puts += 1
+            if self.total is None or self.puts % CACHE_RECOUNT == 0:
+                self.total = self.size()
+            else:
+                self.total += len(blob) - replaced
+            if self.total > self.max_bytes:
+                self.evict(self.max_bytes)
+
+    def size(self):
+        return self.connect().execute("SELECT COALESCE(SUM(size), 0) FROM tables").fetchone()[0]
+
+    # Drop least recently used entries until the cached data fits in
+    # max_bytes, by the running count when there is one
+    def evict(self, max_bytes):
+        conn = self.connect()
+        total = self.size() if self.total is None else self.total
+        while total > max_bytes:
+            rows = conn.execute("SELECT key, size FROM tables ORDER BY used LIMIT ?", (CACHE_EVICT_BATCH,)).fetchall()
+            if not rows:
+                break
+            drop = []
+            for key, size in rows:
+                drop.append((key,))
+                total -= size
+                if total <= max_bytes:
+                    break
+            conn.executemany("DELETE FROM tables WHERE key = ?", drop)
+        self.total = total
+
+    # Drop everything, or everything not characterized by keep_version
+    def invalidate(self, keep_version=None):
+        if keep_version is None:
+            self.connect().execute("DELETE FROM tables")
+        else:
+            self.connect().execute("DELETE FROM tables WHERE version != ?", (str(keep_version),))
+
+    def close(self):
+        if self.conn is not None and self.pid == os.getpid():
+            self.conn.close()
+        self.conn = None
 
 class PGPin:
 
@@ -493,34 +1836,43 @@ class PGPin:
         self.name = get_name(self)
         # For now only implement primary power/ground. If anyone needs secondary power/ground, you get to update this!
         require_values(self, "pg_type", ["primary_power", "primary_ground"])
-        require_values(self, "name", self.cell.lib.voltage_names())
+        require_values(self, "name", list(self.cell.lib.voltage_names()))
         self.type = self.attr["pg_type"]
 
     def emit(self, corner):
-        output = "pg_pin (%s) {\n" % self.name
-        output += indent("pg_type : %s;\n" % self.type)
+        return emit_string(self.emit_to, corner)
+
+    def emit_to(self, fp, corner, lvl=0):
+        p1 = pad(lvl+1)
+        output  = pad(lvl) + "pg_pin (%s) {\n" % self.name
+        output += p1 + "pg_type : %s;\n" % self.type
         # For now assert that voltage_name is the same as the pin name
-        output += indent("voltage_name : %s;\n" % self.name)
-        output += "}\n"
-        return output
+        output += p1 + "voltage_name : %s;\n" % self.name
+        output += pad(lvl) + "}\n"
+        fp.write(output)
+
+# Whether name is selected by patterns, exact names or fnmatch globs; None
+# selects everything
+def name_selected(name, patterns):
+    return patterns is None or any(name == p or fnmatch.fnmatchcase(name, p) for p in patterns)
 
 def get_name(obj):
-    if "name" not in obj.attr.keys():
+    if "name" not in obj.attr:
         sys.stderr.write("Missing name for %s object. Aborting.\n" % obj.__class__.__name__)
         exit(1)
     return obj.attr["name"]
 
 def require_key(obj, key):
-    if key not in obj.attr.keys():
+    if key not in obj.attr:
         sys.stderr.write("Missing required key \"%s\" for %s object %s. Aborting.\n" % (key, obj.__class__.__name__, obj.name))
         exit(1)
 
 def require_key_or_default(obj, key, default=None):
     if default is not None:
         if type(default) is dict:
-            if key in default.keys():
+            if key in default:
                 obj.attr[key] = default[key]
-        elif key not in obj.attr.keys():
+        elif key not in obj.attr:
             obj.attr[key] = default
     require_key(obj, key)
 
@@ -564,18 +1916,1388 @@ def require_int(obj, key, default=None):
         exit(1)
     return obj.attr[key]
 
-def indent(s, lvl=1):
-    return re.compile('^([^\n])',re.MULTILINE).sub(" " * IWIDTH * lvl + "\\1", s)
+# Whole-document JSON validation. The schema below is compiled once into
+# checker functions; a checker walks its part of the document and appends
+# every problem it finds to errors as "path: message", so a bad file gets
+# one report listing all of its errors instead of aborting on the first.
+
+def is_float_list(v):
+    return type(v) == type([]) and all(type(x) == type(0.0) for x in v)
+
+SCHEMA_TYPES = {
+    "str":    (lambda v: type(v) == type(""), "a string"),
+    "int":    (lambda v: type(v) == type(0), "an int"),
+    "float":  (lambda v: type(v) == type(0.0), "a float"),
+    "bool":   (lambda v: type(v) == type(False), "true or false"),
+    "list":   (lambda v: type(v) == type([]), "a list"),
+    "dict":   (lambda v: type(v) == type({}), "an object"),
+    "floats": (is_float_list, "a list of floats"),
+    "any":    (lambda v: True, "anything"),
+}
+
+# choices is a list or a function of the validation context returning one.
+# With defaults=True the value comes from the cell's "defaults" when given
+# there, as in require_key_or_default.
+def field(key, kind, required=False, choices=None, defaults=False):
+    return (key, SCHEMA_TYPES[kind], required, choices, defaults)
+
+def fields_checker(fields):
+    def check(obj, path, errors, ctx):
+        for key, (valid, desc), required, choices, defaults in fields:
+            if defaults and key in ctx.get("defaults", {}):
+                value = ctx["defaults"][key]
+            elif key in obj:
+                value = obj[key]
+            else:
+                if required:
+                    errors.append("%s: missing required key \"%s\"" % (path, key))
+                continue
+            if not valid(value):
+                errors.append("%s: invalid entry \"%s\" for attribute \"%s\", must be %s" % (path, value, key, desc))
+            elif choices is not None:
+                allowed = choices(ctx) if callable(choices) else choices
+                if value not in allowed:
+                    errors.append("%s: invalid entry \"%s\" for attribute \"%s\", allowed values are %s" % (path, value, key, ", ".join(allowed)))
+    return check
+
+def object_checker(fields, extra=None):
+    check_fields = fields_checker(fields)
+    def check(obj, path, errors, ctx):
+        if type(obj) != type({}):
+            errors.append("%s: expected an object" % path)
+            return
+        check_fields(obj, path, errors, ctx)
+        if extra is not None:
+            extra(obj, path, errors, ctx)
+    return check
+
+def list_checker(item, key):
+    def check(obj, path, errors, ctx):
+        if type(obj.get(key)) == type([]):
+            for i, x in enumerate(obj[key]):
+                item(x, "%s.%s[%d]" % (path, key, i), errors, ctx)
+    return check
+
+def check_corner_extra(obj, path, errors, ctx):
+    if type(obj.get("voltage_map")) == type({}):
+        for k, v in obj["voltage_map"].items():
+            if type(v) != type(0.0):
+                errors.append("%s: invalid voltage \"%s\" for \"%s\" in voltage_map, must be a float" % (path, v, k))
+    for key, template in CORNER_TEMPLATES:
+        if type(obj.get(key)) == type({}):
+            template(obj[key], "%s.%s" % (path, key), errors, ctx)
+        if type(obj.get("characterization_templates")) == type({}) and type(obj["characterization_templates"].get(key)) == type({}):
+            template(obj["characterization_templates"][key], "%s.characterization_templates.%s" % (path, key), errors, ctx)
+
+CORNER_TEMPLATES = [
+    ("constraint_template", object_checker([field("related_pin_transition", "floats", True), field("constrained_pin_transition", "floats", True)])),
+    ("delay_template", object_checker([field("input_net_transition", "floats", True), field("total_output_net_capacitance", "floats", True)])),
+]
+
+check_corner = object_checker([
+    field("name", "str", True),
+    field("short_name", "str"),
+    field("process", "int", True),
+    field("temperature", "int", True),
+    field("nominal_voltage", "float", True),
+    field("voltage_map", "dict", True),
+    field("constraint_template", "dict", True),
+    field("delay_template", "dict", True),
+    field("characterization_templates", "dict"),
+    field("derive", "dict"),
+], check_corner_extra)
+
+check_pg_pin = object_checker([
+    field("name", "str", True, lambda ctx: ctx["voltage_names"]),
+    field("pg_type", "str", True, ["primary_power", "primary_ground"]),
+])
+
+check_digital_pin = fields_checker([
+    field("clock", "bool"),
+    field("reset", "bool"),
+    field("sequential", "bool"),
+    field("clock_edge", "str", False, list(CLOCK_EDGES.keys())),
+    field("timing", "list"),
+    field("related_power_pin", "str", True, lambda ctx: ctx["power_pins"], True),
+    field("related_ground_pin", "str", True, lambda ctx: ctx["ground_pins"], True),
+])
+check_input_pin = fields_checker([
+    field("capacitance", "float", True, None, True),
+    field("max_transition", "float", True, None, True),
+])
+check_output_pin = fields_checker([
+    field("max_capacitance", "float", True, None, True),
+])
+check_bus_pin = fields_checker([
+    field("bus_max", "int"),
+    field("bus_min", "int"),
+])
+
+def check_pin_extra(obj, path, errors, ctx):
+    if obj.get("is_bus") is True:
+        check_bus_pin(obj, path, errors, ctx)
+    if obj.get("is_analog") is True:
+        return
+    check_digital_pin(obj, path, errors, ctx)
+    if obj.get("clock") is True and obj.get("reset") is True:
+        errors.append("%s: pin cannot be both clock and reset" % path)
+    elif obj.get("clock") is not True and obj.get("sequential") is True:
+        if "related_clock" not in obj:
+            errors.append("%s: missing required key \"related_clock\"" % path)
+        else:
+            check_related_pins(obj["related_clock"], "related_clock", ctx["clocks"], "a clock, give it the \"clock : true\" attribute", path, errors)
+    if type(obj.get("timing")) == type([]):
+        for i, t in enumerate(obj["timing"]):
+            check_timing(t, "%s.timing[%d]" % (path, i), errors, ctx)
+    direction = obj.get("direction")
+    if direction == "inout":
+        errors.append("%s: digital inout pins are not supported" % path)
+    elif direction == "input":
+        check_input_pin(obj, path, errors, ctx)
+    elif direction == "output":
+        check_output_pin(obj, path, errors, ctx)
+
+# A pin name or a list of them, each of which must be in names
+def check_related_pins(value, key, names, desc, path, errors):
+    values = value if type(value) == type([]) else [value]
+    for v in values:
+        if type(v) != type(""):
+            errors.append("%s: invalid entry \"%s\" for attribute \"%s\", must be a string or a list of strings" % (path, value, key))
+        elif v not in names:
+            errors.append("%s: %s \"%s\" is not defined as %s" % (path, key, v, desc))
+
+def check_timing_extra(obj, path, errors, ctx):
+    arc_class = TIMING_ARC_CLASSES.get(obj.get("timing_type"))
+    if arc_class is None or "related_pin" not in obj:
+        return
+    if arc_class is CombinationalArc:
+        check_related_pins(obj["related_pin"], "related_pin", ctx["inputs"], "a digital input", path, errors)
+    else:
+        check_related_pins(obj["related_pin"], "related_pin", ctx["clocks"], "a clock, give it the \"clock : true\" attribute", path, errors)
+
+check_timing = object_checker([
+    field("timing_type", "str", True, list(TIMING_ARC_CLASSES.keys())),
+    field("related_pin", "any", True),
+    field("timing_sense", "str", False, TIMING_SENSES),
+], check_timing_extra)
+
+check_pin = object_checker([
+    field("name", "str", True),
+    field("direction", "str", True, ["input", "output", "inout"]),
+    field("is_bus", "bool"),
+    field("is_analog", "bool"),
+], check_pin_extra)
+
+check_pg_pins = list_checker(check_pg_pin, "pg_pins")
+check_pins = list_checker(check_pin, "pins")
+
+def check_cell_extra(obj, path, errors, ctx):
+    pg_pins = [x for x in obj.get("pg_pins", []) if type(x) == type({})] if type(obj.get("pg_pins")) == type([]) else []
+    pins = [x for x in obj.get("pins", []) if type(x) == type({})] if type(obj.get("pins")) == type([]) else []
+    ctx = dict(ctx)
+    ctx["defaults"] = obj["defaults"] if type(obj.get("defaults")) == type({}) else {}
+    ctx["power_pins"] = [x.get("name") for x in pg_pins if x.get("pg_type") == "primary_power"]
+    ctx["ground_pins"] = [x.get("name") for x in pg_pins if x.get("pg_type") == "primary_ground"]
+    ctx["clocks"] = set(x.get("name") for x in pins if x.get("clock") is True and x.get("is_analog") is not True)
+    ctx["inputs"] = set(x.get("name") for x in pins if x.get("direction") == "input" and x.get("is_analog") is not True)
+    check_pg_pins(obj, path, errors, ctx)
+    check_pins(obj, path, errors, ctx)
+
+check_cell = object_checker([
+    field("name", "str", True),
+    field("defaults", "dict"),
+    field("pg_pins", "list", True),
+    field("pins", "list", True),
+], check_cell_extra)
+
+check_library = object_checker([
+    field("name", "str", True),
+    field("revision", "int", True),
+    field("cells", "list"),
+    field("cell_files", "list"),
+], list_checker(check_cell, "cells"))
+
+# Returns the list of problems found in a corners document (the "corners" list)
+def validate_corners(corner_attr, path="corners"):
+    errors = []
+    if type(corner_attr) != type([]) or len(corner_attr) == 0:
+        return ["%s: expected a non-empty list of corners" % path]
+    for i, c in enumerate(corner_attr):
+        check_corner(c, "%s[%d]" % (path, i), errors, {})
+    maps = [c["voltage_map"] for c in corner_attr if type(c) == type({}) and type(c.get("voltage_map")) == type({})]
+    if any(set(m.keys()) != set(maps[0].keys()) for m in maps):
+        errors.append("%s: all corners must have the same voltage names" % path)
+    return errors
+
+# Returns the list of problems found in a library document. voltage_names
+# are the corners' voltage names, which pg pins must be drawn from.
+def validate_library(lib_attr, voltage_names, path="library"):
+    errors = []
+    check_library(lib_attr, path, errors, {"voltage_names": list(voltage_names)})
+    if type(lib_attr) == type({}) and "cells" not in lib_attr and "cell_files" not in lib_attr:
+        errors.append("%s: missing required key \"cells\"" % path)
+    return errors
+
+def validate_cells(cells, voltage_names, path):
+    errors = []
+    if type(cells) != type([]):
+        return ["%s: expected a cell or a list of cells" % path]
+    ctx = {"voltage_names": list(voltage_names)}
+    for i, c in enumerate(cells):
+        check_cell(c, "%s[%d]" % (path, i), errors, ctx)
+    return errors
+
+# Leading whitespace for a line at indentation depth lvl
+def pad(lvl):
+    return " " * IWIDTH * lvl
+
+# Run an emit_to method against a string buffer and return the result
+def emit_string(emit_to, *args):
+    fp = io.StringIO()
+    emit_to(fp, *args)
+    return fp.getvalue()
+
+# Instrumentation: call counts and cumulative wall time per phase, broken
+# down by corner, cell and arc type, plus a Chrome trace (chrome://tracing,
+# Perfetto) of the spans. Phases are "write" (one corner's file),
+# "characterize" and "emit" (one cell), "arc" (building one arc) and
+# "characterizer" (the characterizer filling one table). Spans nest, so
+# times are inclusive. Written out at the end of Library.write_all: the
+# summary as JSON to summary, the trace to trace, and a text summary to
+# stderr if neither path is given.
+class Instrumentation:
+
+    def __init__(self, trace=None, summary=None):
+        self.trace = trace
+        self.summary = summary
+        self.reset()
+
+    def reset(self):
+        self.events = []
+        # (dimension, key, phase) -> [count, seconds]
+        self.totals = {}
+
+    def span(self, phase, corner=None, cell=None, arc=None, trace=True):
+        return Span(self, phase, corner, cell, arc, trace)
+
+    def add(self, phase, corner, cell, arc, start, end, trace):
+        elapsed = end - start
+        for dimension, key in (("phase", phase), ("corner", corner), ("cell", cell), ("arc", arc)):
+            if key is not None:
+                total = self.totals.setdefault((dimension, key, phase), [0, 0.0])
+                total[0] += 1
+                total[1] += elapsed
+        if trace:
+            args = {}
+            for k, v in (("corner", corner), ("cell", cell), ("arc", arc)):
+                if v is not None:
+                    args[k] = v
+            name = arc or cell or corner or phase
+            self.events.append({"name": name, "cat": phase, "ph": "X", "ts": start * 1e6, "dur": elapsed * 1e6, "pid": os.getpid(), "tid": 0, "args": args})
+
+    # Records from a worker process, see write_corner_worker
+    def export(self):
+        return (self.events, list(self.totals.items()))
+
+    def merge(self, exported):
+        if exported is None:
+            return
+        events, totals = exported
+        self.events += events
+        for key, (count, seconds) in totals:
+            total = self.totals.setdefault(key, [0, 0.0])
+            total[0] += count
+            total[1] += seconds
+
+    def summary_dict(self):
+        out = {}
+        for (dimension, key, phase), (count, seconds) in sorted(self.totals.items()):
+            if dimension == "phase":
+                out.setdefault("phase", {})[phase] = {"count": count, "seconds": seconds}
+            else:
+                out.setdefault(dimension, {}).setdefault(key, {})[phase] = {"count": count, "seconds": seconds}
+        return out
+
+    def write(self):
+        if self.trace is not None:
+            with open(self.trace, "w") as fp:
+                json.dump({"traceEvents": self.events, "displayTimeUnit": "ms"}, fp)
+        if self.summary is not None:
+            with open(self.summary, "w") as fp:
+                json.dump(self.summary_dict(), fp, indent=1, sort_keys=True)
+        if self.trace is None and self.summary is None:
+            sys.stderr.write(self.summary_text())
+
+    def summary_text(self, top=10):
+        summary = self.summary_dict()
+        output = "%-40s %10s %12s\n" % ("phase", "count", "seconds")
+        for phase, t in sorted(summary.get("phase", {}).items(), key=lambda kv: -kv[1]["seconds"]):
+            output += "%-40s %10d %12.3f\n" % (phase, t["count"], t["seconds"])
+        for dimension in ("corner", "arc", "cell"):
+            rows = []
+            for key, phases in summary.get(dimension, {}).items():
+                for phase, t in phases.items():
+                    rows.append(("%s %s" % (key, phase), t["count"], t["seconds"]))
+            rows.sort(key=lambda r: -r[2])
+            if rows:
+                output += "\n%-40s %10s %12s\n" % ("by " + dimension, "count", "seconds")
+                for r in rows[:top]:
+                    output += "%-40s %10d %12.3f\n" % r
+        return output
+
+class Span:
+
+    __slots__ = ("instr", "phase", "corner", "cell", "arc", "trace", "start")
 
-def read_library_json(libfile, cornerfile, library_namer=default_library_namer, characterizer=default_characterizer):
+    def __init__(self, instr, phase, corner, cell, arc, trace):
+        self.instr = instr
+        self.phase = phase
+        self.corner = corner
+        self.cell = cell
+        self.arc = arc
+        self.trace = trace
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.instr.add(self.phase, self.corner, self.cell, self.arc, self.start, time.perf_counter(), self.trace)
+        return False
+
+def instrumentation_from_env():
+    trace = os.environ.get("DOTLIBBER_TRACE")
+    summary = os.environ.get("DOTLIBBER_SUMMARY")
+    if trace or summary:
+        return Instrumentation(trace or None, summary or None)
+    return None
+
+# Per-process state for Library.write_all_parallel
+corner_worker_state = None
+
+def init_corner_worker(libs, stream, incremental, compression):
+    global corner_worker_state
+    # Corners are already spread over processes, characterize serially
+    for lib in libs:
+        lib.executor = None
+    corner_worker_state = (libs, stream, incremental, compression)
+
+# Tables per characterize_parallel submission
+CHARACTERIZE_CHUNK = 16
+
+characterize_worker_state = None
+
+def init_characterize_worker(lib):
+    global characterize_worker_state
+    characterize_worker_state = lib
+
+# Process pool for Library.characterize_parallel, with the library installed
+# in every worker
+def characterization_process_pool(lib, workers=None):
+    return concurrent.futures.ProcessPoolExecutor(max_workers=workers, initializer=init_characterize_worker, initargs=(lib,))
+
+# Characterize a chunk of tables of one corner, given as (cell index, pin
+# index, arc spec index, table index), and return their values in order. Thread
+# pools are handed the library itself, process pool workers find it in
+# characterize_worker_state, which must be of the library's generation.
+def characterize_chunk_worker(job):
+    lib, generation, corner_index, items = job
+    if lib is None:
+        lib = characterize_worker_state
+        if lib is None:
+            raise Exception("Process pool workers have no library, create the pool with characterization_process_pool(lib).")
+        if lib.generation != generation:
+            raise Exception("Process pool workers hold library \"%s\" from before it was edited, create a new pool with characterization_process_pool(lib)." % lib.name)
+    corner = (lib.corners + lib.source_corners)[corner_index]
+    values = []
+    for ci, pi, si, k in items:
+        pin = lib.cells[ci].all_pins[pi]
+        values.append(characterize_table(*pin.arc_specs()[si].table_requests(pin, corner)[k]).values)
+    return values
+
+# Returns (corner name, error text or None, cell sections, instrumentation
+# records, seconds). The Aborting
+# paths call exit(1), so SystemExit is caught here too and whatever was
+# written to stderr is handed back to the parent instead of taking down the
+# pool.
+def write_corner_worker(job):
+    libs, stream, incremental, compression = corner_worker_state
+    lib_index, index, f, reuse = job
+    lib = libs[lib_index]
+    corner = lib.corners[index]
+    instr = lib.instrumentation
+    if instr is not None:
+        instr.reset()
+    err = io.StringIO()
+    start = time.perf_counter()
     try:
-        lib_attr = json.load(open(libfile))
-    except:
-        sys.stderr.write("Syntax error parsing JSON file %s. Aborting.\n" % libfile)
+        with contextlib.redirect_stderr(err):
+            sections = lib.write_corner(corner, f, stream, reuse, [] if incremental else None, compression)
+    except (Exception, SystemExit) as e:
+        if isinstance(e, SystemExit) or err.getvalue():
+            return (corner.name, err.getvalue() or "exit(%s)\n" % e.code, None, instr and instr.export(), 0.0)
+        return (corner.name, err.getvalue() + "%s: %s\n" % (e.__class__.__name__, e), None, instr and instr.export(), 0.0)
+    return (corner.name, None, sections, instr and instr.export(), time.perf_counter() - start)
+
+# Write one .lib per corner for each of the libraries, see Library.write_all.
+# Every library x corner is a job of its own, so with workers > 1 they are
+# all spread over one process pool, and libraries sharing corners (see
+# read_library_batch) are pickled into the workers once, with the corners
+# shared. With incremental, one manifest covers all the libraries.
+#
+# Returns per library totals: the corners written, the seconds spent
+# writing them (summed over workers) and their size in bytes.
+def write_libraries(libs, file_namer=default_file_namer, file_dir=None, workers=1, stream=False, incremental=False, manifest=None, compression=None, compression_level=None):
+    suffix = compression_suffix(compression)
+    files = [[lib.corner_file(c, file_namer, file_dir) + suffix for c in lib.corners] for lib in libs]
+    compression = (compression, compression_level)
+    if incremental:
+        if manifest is None:
+            manifest = os.path.join(os.path.dirname(files[0][0]), MANIFEST_NAME)
+        old = read_manifest(manifest)
+    jobs = []
+    # Files this call doesn't write, e.g. of other libraries or corners
+    # written to the same directory, keep their entries
+    entries = dict(old) if incremental else {}
+    for n, lib in enumerate(libs):
+        for i, corner in enumerate(lib.corners):
+            f = files[n][i]
+            reuse = None
+            if incremental:
+                entry = lib.manifest_entry(corner)
+                state = manifest_state(old.get(f), entry, f)
+                if state == "clean":
+                    continue
+                if state == "cells" and incremental == "cells":
+                    reuse = manifest_reuse(old[f], entry)
+                entries[f] = entry
+            jobs.append((n, i, f, reuse))
+
+    if workers is None or workers > 1:
+        results = write_corners_parallel(libs, jobs, workers, stream, incremental, compression)
+    else:
+        results = []
+        for n, i, f, reuse in jobs:
+            start = time.perf_counter()
+            sections = libs[n].write_corner(libs[n].corners[i], f, stream, reuse, [] if incremental else None, compression)
+            results.append((sections, time.perf_counter() - start))
+
+    stats = [{"library": lib.name, "cells": len(lib.cells), "corners": 0, "seconds": 0.0, "bytes": 0} for lib in libs]
+    for (n, i, f, reuse), (sections, seconds) in zip(jobs, results):
+        size = os.path.getsize(f)
+        if incremental:
+            entries[f]["sections"] = sections
+            entries[f]["size"] = size
+        stats[n]["corners"] += 1
+        stats[n]["seconds"] += seconds
+        stats[n]["bytes"] += size
+    if incremental:
+        write_manifest(manifest, entries)
+    written = []
+    for lib in libs:
+        if lib.instrumentation is not None and not any(lib.instrumentation is w for w in written):
+            lib.instrumentation.write()
+            written.append(lib.instrumentation)
+    return stats
+
+# Returns (cell sections, seconds) per job, see write_libraries
+def write_corners_parallel(libs, jobs, workers=None, stream=False, incremental=False, compression=(None, None)):
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers, initializer=init_corner_worker, initargs=(libs, stream, incremental, compression)) as pool:
+        results = list(pool.map(write_corner_worker, jobs))
+    failed = 0
+    for job, r in zip(jobs, results):
+        lib = libs[job[0]]
+        if lib.instrumentation is not None:
+            lib.instrumentation.merge(r[3])
+        if r[1] is not None:
+            failed += 1
+            if len(libs) > 1:
+                sys.stderr.write("Error writing corner \"%s\" of library \"%s\":\n%s" % (r[0], lib.name, r[1]))
+            else:
+                sys.stderr.write("Error writing corner \"%s\":\n%s" % (r[0], r[1]))
+    if failed:
+        sys.stderr.write("Failed to write %d of %d corners. Aborting.\n" % (failed, len(jobs)))
         exit(1)
+    return [(r[2], r[4]) for r in results]
+
+# One line per library of write_libraries totals
+def report_throughput(stats, fp=sys.stdout):
+    fp.write("%-24s %7s %7s %9s %9s %9s %9s\n" % ("library", "cells", "corners", "seconds", "MB", "cells/s", "MB/s"))
+    for s in stats:
+        rate = 1 / s["seconds"] if s["seconds"] > 0 else 0.0
+        fp.write("%-24s %7d %7d %9.2f %9.1f %9.1f %9.1f\n" % (s["library"], s["cells"], s["corners"], s["seconds"], s["bytes"] / 1e6, s["cells"] * s["corners"] * rate, s["bytes"] / 1e6 * rate))
+
+# Incremental regeneration, see Library.write_all
+MANIFEST_NAME = "dotlibber_manifest.json"
+
+def hash_json(obj):
+    return hashlib.sha256(json.dumps(obj, sort_keys=True).encode()).hexdigest()
+
+def read_manifest(path):
+    try:
+        with open(path) as fp:
+            return json.load(fp)["files"]
+    except (OSError, ValueError, KeyError):
+        return {}
+
+def write_manifest(path, entries):
+    tmp = path + ".tmp"
+    with open(tmp, "w") as fp:
+        json.dump({"files": entries}, fp, indent=1, sort_keys=True)
+    os.replace(tmp, path)
+
+# "clean" if the file is up to date, "cells" if only some cells changed and
+# the old file can be spliced, None if it has to be written from scratch
+def manifest_state(old, entry, f):
+    if old is None or "sections" not in old or not os.path.exists(f) or os.path.getsize(f) != old.get("size"):
+        return None
+    if old["header"] != entry["header"]:
+        return None
+    if old["cells"] == entry["cells"]:
+        return "clean"
+    return "cells"
+
+# Sections of the old file for the cells whose hash did not change
+def manifest_reuse(old, entry):
+    old_hashes = dict((name, h) for name, h in old["cells"])
+    unchanged = set(name for name, h in entry["cells"] if old_hashes.get(name) == h)
+    return dict((name, (start, end)) for name, start, end in old["sections"] if name in unchanged)
+
+# Passes writes through to fp, counting characters written
+class CountingWriter:
+
+    def __init__(self, fp):
+        self.fp = fp
+        self.count = 0
+
+    def write(self, s):
+        self.count += len(s)
+        self.fp.write(s)
+
+# Reads cell groups back out of a previously written .lib. sections maps cell
+# name to (start, end) character offsets of the uncompressed text; cells
+# must be read in file order.
+class SectionReader:
+
+    def __init__(self, path, sections, compression=None):
+        self.path = path
+        self.compression = compression
+        self.fp = open_lib(path, "r", compression)
+        self.sections = sections
+        self.pos = 0
+
+    def has(self, name):
+        return name in self.sections
+
+    def read(self, name):
+        start, end = self.sections[name]
+        if start < self.pos:
+            # Compressed streams can't seek back, start over
+            self.fp.close()
+            self.fp = open_lib(self.path, "r", self.compression)
+            self.pos = 0
+        while self.pos < start:
+            self.pos += len(self.fp.read(min(start - self.pos, 1 << 20)))
+        text = self.fp.read(end - start)
+        self.pos += len(text)
+        return text
+
+    def close(self):
+        self.fp.close()
+
+COMPRESSION_SUFFIXES = {None: "", "gzip": ".gz", "zstd": ".zst"}
+
+def compression_suffix(compression):
+    if compression not in COMPRESSION_SUFFIXES:
+        sys.stderr.write("Unknown compression \"%s\", use gzip or zstd. Aborting.\n" % compression)
+        exit(1)
+    if compression == "zstd" and zstandard is None:
+        sys.stderr.write("zstd compression requires the zstandard package. Aborting.\n")
+        exit(1)
+    return COMPRESSION_SUFFIXES[compression]
+
+# Writes no file name into the gzip header, which would otherwise be that
+# of the temporary file, and closes the file it writes to
+class NamelessGzipFile(gzip.GzipFile):
+
+    def __init__(self, fp, level):
+        gzip.GzipFile.__init__(self, "", "wb", level, fp, mtime=0)
+        self.fp = fp
+
+    def close(self):
+        try:
+            gzip.GzipFile.close(self)
+        finally:
+            self.fp.close()
+
+# Open a .lib as text for writing ("w") or reading ("r"), compressed with
+# gzip or zstd. gzip output has no timestamp, so unchanged input gives an
+# identical file.
+def open_lib(path, mode, compression=None, level=None):
+    compression_suffix(compression)
+    if compression is None:
+        return open(path, mode)
+    if compression == "gzip":
+        if mode == "w":
+            return io.TextIOWrapper(NamelessGzipFile(open(path, "wb"), 9 if level is None else level))
+        return io.TextIOWrapper(gzip.GzipFile(path, "rb"))
+    if mode == "w":
+        return io.TextIOWrapper(zstandard.ZstdCompressor(level=3 if level is None else level).stream_writer(open(path, "wb")))
+    return io.TextIOWrapper(zstandard.ZstdDecompressor().stream_reader(open(path, "rb")))
+
+# Building a large library allocates millions of small objects, none of them
+# garbage, and the cyclic collector would otherwise rescan all of them over
+# and over. Pause it while loading.
+@contextlib.contextmanager
+def gc_paused():
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+def load_json(path, errors):
     try:
-        corner_attr = json.load(open(cornerfile))["corners"]
-    except:
-        sys.stderr.write("Syntax error parsing JSON file %s. Aborting.\n" % cornerfile)
+        with open(path, "rb") as fp:
+            return json.loads(fp.read())
+    except (OSError, ValueError) as e:
+        errors.append("%s: %s" % (path, e))
+        return None
+
+# Load and validate one file of a split library. A cell file holds a single
+# cell, a list of cells, or an object with a "cells" list. Returns (cells,
+# errors) so it can run in a worker process.
+def load_cell_file(job):
+    path, voltage_names = job
+    errors = []
+    attr = load_json(path, errors)
+    if attr is None:
+        return [], errors
+    if type(attr) == type({}):
+        attr = attr["cells"] if "cells" in attr else [attr]
+    errors += validate_cells(attr, voltage_names, path)
+    return attr, errors
+
+# Read a library JSON and a corners JSON into a Library. Both documents are
+# validated in full before anything is built, and every problem found is
+# reported at once. A library may list additional cell files in
+# "cell_files" (paths relative to the library file); with workers > 1 they
+# are parsed and validated in a process pool.
+#
+# cells, corner_names and pins are lists of names or globs that restrict the
+# library to a subset, see Library.
+def read_library_json(libfile, cornerfile, library_namer=default_library_namer, characterizer=default_characterizer, cache=None, bus_bits=False, workers=1, instrumentation=None, concurrency=16, cells=None, corner_names=None, pins=None):
+    with gc_paused():
+        return load_library_json(libfile, cornerfile, library_namer, characterizer, cache, bus_bits, workers, instrumentation, concurrency, cells, corner_names, pins)
+
+def load_library_json(libfile, cornerfile, library_namer, characterizer, cache, bus_bits, workers, instrumentation, concurrency, cells=None, corner_names=None, pins=None):
+    errors = []
+    lib_attr = load_json(libfile, errors)
+    corner_attr, voltage_names = load_corners_json(cornerfile, errors)
+    lib_attr = load_library_attr(lib_attr, libfile, voltage_names, workers, errors)
+    if errors:
+        report_errors(errors)
+    return Library(lib_attr, corner_attr, library_namer, characterizer, cache=cache, bus_bits=bus_bits, instrumentation=instrumentation, concurrency=concurrency, cells=cells, corner_names=corner_names, pins=pins)
+
+# Read many library JSONs against one corners JSON. The corners are parsed,
+# validated and built once and shared by all the libraries, along with the
+# characterizer, cache and instrumentation, so templates, resamplers and
+# characterizer state stay warm from one library to the next. All files
+# are validated before anything is built. Write the result with
+# write_libraries.
+def read_library_batch(libfiles, cornerfile, library_namer=default_library_namer, characterizer=default_characterizer, cache=None, bus_bits=False, workers=1, instrumentation=None, concurrency=16, cells=None, corner_names=None, pins=None):
+    with gc_paused():
+        errors = []
+        lib_attrs = [load_json(f, errors) for f in libfiles]
+        corner_attr, voltage_names = load_corners_json(cornerfile, errors)
+        lib_attrs = [load_library_attr(a, f, voltage_names, workers, errors) for a, f in zip(lib_attrs, libfiles)]
+        if errors:
+            report_errors(errors)
+        corners = corner_attr
+        libs = []
+        for a in lib_attrs:
+            lib = Library(a, corners, library_namer, characterizer, cache=cache, bus_bits=bus_bits, instrumentation=instrumentation, concurrency=concurrency, cells=cells, corner_names=corner_names, pins=pins)
+            corners = lib.corners + lib.source_corners
+            libs.append(lib)
+        return libs
+
+# The corner list of a corners JSON and its voltage names, which the cells
+# are validated against. Load errors already in errors are reported along
+# with the corner file's own.
+def load_corners_json(cornerfile, errors):
+    corner_doc = load_json(cornerfile, errors)
+    if errors:
+        report_errors(errors)
+    if type(corner_doc) != type({}) or "corners" not in corner_doc:
+        report_errors(["%s: missing required key \"corners\"" % cornerfile])
+    corner_attr = corner_doc["corners"]
+    errors += validate_corners(corner_attr, cornerfile)
+    voltage_names = []
+    for c in corner_attr if type(corner_attr) == type([]) else []:
+        if type(c) == type({}) and type(c.get("voltage_map")) == type({}):
+            voltage_names = list(c["voltage_map"].keys())
+            break
+    return corner_attr, voltage_names
+
+# Validate a library document and pull in its cell_files
+def load_library_attr(lib_attr, libfile, voltage_names, workers, errors):
+    errors += validate_library(lib_attr, voltage_names, libfile)
+    if type(lib_attr) == type({}) and type(lib_attr.get("cell_files")) == type([]):
+        base = os.path.dirname(os.path.abspath(libfile))
+        jobs = [(os.path.join(base, f), voltage_names) for f in lib_attr["cell_files"]]
+        if workers is None or (workers > 1 and len(jobs) > 1):
+            with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+                results = list(pool.map(load_cell_file, jobs))
+        else:
+            results = [load_cell_file(job) for job in jobs]
+        cells = list(lib_attr.get("cells", []))
+        for c, e in results:
+            cells += c
+            errors += e
+        lib_attr = dict(lib_attr)
+        del lib_attr["cell_files"]
+        lib_attr["cells"] = cells
+    return lib_attr
+
+def report_errors(errors):
+    for e in errors:
+        sys.stderr.write("Error: %s\n" % e)
+    sys.stderr.write("Found %d error%s in the input JSON. Aborting.\n" % (len(errors), "" if len(errors) == 1 else "s"))
+    exit(1)
+
+# Liberty reader. LibertyReader tokenizes a .lib through an mmap, so only the
+# groups asked for are held in memory: a group the skip callback rejects is
+# stepped over with a brace scan and kept as an unloaded LibertyGroup, just
+# its offsets, that LibertyReader.load can parse later. read_liberty builds a
+# Library on top of this, leaving the table values in the files until the
+# tables are emitted.
+
+# Whitespace, line continuations and comments, then one token: a string, a
+# word, punctuation, the end of the file, or a character that starts none.
+# The token alternatives can't all fail, so the whitespace loop never
+# backtracks.
+LIBERTY_TOKEN_RE = re.compile(rb'(?:\s+|\\\r?\n|/\*.*?\*/|//[^\n]*)*(?:"([^"\\]*(?:\\.[^"\\]*)*)"|([^\s(){}:;,"\\]+)|([(){}:;,])|(\Z)|(.))', re.S)
+LIBERTY_SKIP_RE = re.compile(rb'"[^"\\]*(?:\\.[^"\\]*)*"|/\*.*?\*/|//[^\n]*|[{}]', re.S)
+# Table groups are read straight from their index and values arguments
+LIBERTY_TABLE_RE = re.compile(rb'\b(index_1|index_2|values)\s*\(([^()]*)\)')
+LIBERTY_STRING_RE = re.compile(rb'"([^"]*)"')
+
+class LibertyGroup:
+
+    __slots__ = ("type", "args", "attrs", "groups", "start", "end")
+
+    def __init__(self, type, args, start, end=None):
+        self.type = type
+        self.args = args
+        # (name, value), value a string for simple attributes and a list of
+        # strings for complex ones. None until the group is loaded.
+        self.attrs = None
+        self.groups = None
+        # Offsets of the body, from just past "{" to just past "}"
+        self.start = start
+        self.end = end
+
+    def get(self, name, default=None):
+        for k, v in self.attrs:
+            if k == name:
+                return v
+        return default
+
+class LibertyReader:
+
+    def __init__(self, path):
+        self.path = path
+        self.fp = None
+        self.buf = None
+        self.pos = 0
+        self.open()
+
+    def open(self):
+        if self.buf is None:
+            self.fp = open(self.path, "rb")
+            try:
+                self.buf = mmap.mmap(self.fp.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                sys.stderr.write("%s is empty. Aborting.\n" % self.path)
+                exit(1)
+
+    def close(self):
+        if self.buf is not None:
+            self.buf.close()
+            self.fp.close()
+            self.buf = None
+
+    # mmaps don't pickle, a reader handed to another process reopens the file
+    def __getstate__(self):
+        return {"path": self.path, "fp": None, "buf": None, "pos": 0}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.open()
+
+    def error(self, message):
+        line = self.buf[:self.pos].count(b"\n") + 1
+        sys.stderr.write("%s:%d: %s. Aborting.\n" % (self.path, line, message))
         exit(1)
-    return Library(lib_attr, corner_attr, library_namer, characterizer)
+
+    # Returns (kind, text): kind is "word", "string", the punctuation
+    # character, or "" at the end of the file
+    def token(self):
+        m = LIBERTY_TOKEN_RE.match(self.buf, self.pos)
+        self.pos = m.end()
+        if m.group(2) is not None:
+            return "word", m.group(2).decode("latin-1")
+        if m.group(1) is not None:
+            return "string", m.group(1).decode("latin-1")
+        if m.group(3) is not None:
+            return m.group(3).decode("latin-1"), None
+        if m.group(4) is not None:
+            return "", None
+        self.error("Unexpected character %r" % m.group(5).decode("latin-1"))
+
+    def expect(self, kind):
+        k, text = self.token()
+        if k != kind:
+            self.error("Expected \"%s\"" % kind)
+        return text
+
+    # Complex attribute or group arguments, after the "(". Colons are kept
+    # inside arguments, e.g. bus pins like "d[15:0]".
+    def arguments(self):
+        args = []
+        current = None
+        while True:
+            kind, text = self.token()
+            if kind == "," or kind == ")":
+                if current is not None:
+                    args.append(current)
+                current = None
+                if kind == ")":
+                    return args
+            elif kind == "word" or kind == "string" or kind == ":":
+                current = (current or "") + (text if text is not None else ":")
+            else:
+                self.error("Unexpected \"%s\" in arguments" % (kind or "end of file"))
+
+    # Read "type (args) {" at the current position and return the group
+    # unloaded, positioned at the start of its body
+    def open_group(self, type):
+        if self.expect("word") != type:
+            self.error("Expected a %s group" % type)
+        self.expect("(")
+        args = self.arguments()
+        self.expect("{")
+        return LibertyGroup(type, args, self.pos)
+
+    # Yield the (name, value) statements of a group body starting at start,
+    # up to its "}". Subgroups come back as LibertyGroups, loaded unless
+    # skip(type, args) is true.
+    def statements(self, start, skip=None):
+        self.pos = start
+        while True:
+            kind, name = self.token()
+            if kind == "}":
+                return
+            if kind != "word" and kind != "string":
+                self.error("Expected an attribute or group, got \"%s\"" % (kind or "end of file"))
+            kind, text = self.token()
+            if kind == ":":
+                kind, value = self.token()
+                if kind != "word" and kind != "string":
+                    self.error("Expected a value for \"%s\"" % name)
+                save = self.pos
+                if self.token()[0] != ";":
+                    self.pos = save
+                yield name, value
+            elif kind == "(":
+                args = self.arguments()
+                save = self.pos
+                kind, text = self.token()
+                if kind == "{":
+                    group = LibertyGroup(name, args, self.pos)
+                    if skip is not None and skip(name, args):
+                        self.skip_group(group)
+                    else:
+                        self.load(group, skip)
+                    yield name, group
+                else:
+                    if kind != ";":
+                        self.pos = save
+                    yield name, args
+            else:
+                self.error("Expected \":\" or \"(\" after \"%s\"" % name)
+
+    def load(self, group, skip=None):
+        attrs = []
+        groups = []
+        for name, value in self.statements(group.start, skip):
+            if isinstance(value, LibertyGroup):
+                groups.append(value)
+            else:
+                attrs.append((name, value))
+        group.attrs = attrs
+        group.groups = groups
+        group.end = self.pos
+        return group
+
+    def skip_group(self, group):
+        depth = 1
+        for m in LIBERTY_SKIP_RE.finditer(self.buf, group.start):
+            c = m.group()
+            if c == b"{":
+                depth += 1
+            elif c == b"}":
+                depth -= 1
+                if depth == 0:
+                    group.end = self.pos = m.end()
+                    return
+        self.pos = group.start
+        self.error("Unterminated %s group" % group.type)
+
+    # The index_1, index_2 and values of a table group as flat float
+    # arrays. Reads the buffer only, so it is safe to use from threads.
+    def table(self, group):
+        table = {}
+        for m in LIBERTY_TABLE_RE.finditer(self.buf, group.start, group.end):
+            rows = LIBERTY_STRING_RE.findall(m.group(2))
+            table[m.group(1).decode("latin-1")] = array.array("d", map(float, b",".join(rows).split(b","))) if rows else array.array("d")
+        return table
+
+LIBERTY_ARC_CLASSES = TIMING_ARC_CLASSES
+LIBERTY_TABLES = set(name for c in LIBERTY_ARC_CLASSES.values() for name in c.TABLES)
+
+def liberty_floats(text):
+    return [float(x) for x in text.split(",")]
+
+# The tables of the .lib files a Library was read from, replayed as a batch
+# characterizer. A table is read out of its file each time it is asked for,
+# so unless the arcs are kept characterized the values stay on disk.
+class LibertyTables:
+
+    batch = "list"
+
+    def __init__(self):
+        # corner name -> (reader, {(cell, pin, direction, timing_type, related pin, table): unloaded LibertyGroup})
+        self.corners = {}
+
+    # Changes with the source files, so incremental writes see edits to them
+    @property
+    def version(self):
+        return files_version(reader.path for reader, tables in self.corners.values())
+
+    def __call__(self, arc_type, timing_type, pin, related_pin, corner, params):
+        reader, tables = self.corners[corner.name]
+        group = tables.get((pin.cell.name, pin.name, pin.direction, timing_type, related_pin.name, arc_type))
+        if group is None:
+            sys.stderr.write("%s has no %s %s table for pin \"%s\" of cell \"%s\". Aborting.\n" % (reader.path, timing_type, arc_type, pin.name, pin.cell.name))
+            exit(1)
+        table = reader.table(group)
+        template = corner.characterization_template(getattr(corner, LIBERTY_ARC_CLASSES[timing_type].TEMPLATE))
+        for name, index in (("index_1", template.index_1), ("index_2", template.index_2)):
+            if name in table and tuple(table[name]) != index:
+                sys.stderr.write("%s: %s table of pin \"%s\" of cell \"%s\" has its own %s, which doesn't match template %s. Aborting.\n" % (reader.path, arc_type, pin.name, pin.cell.name, name, template.name))
+                exit(1)
+        if "values" not in table:
+            sys.stderr.write("%s: %s table of pin \"%s\" of cell \"%s\" has no values. Aborting.\n" % (reader.path, arc_type, pin.name, pin.cell.name))
+            exit(1)
+        return table["values"]
+
+# Characterizer version of tables read from files: their paths, sizes and
+# modification times
+def files_version(paths):
+    stats = []
+    for path in sorted(paths):
+        st = os.stat(path)
+        stats.append("%s:%d:%d" % (path, st.st_size, st.st_mtime_ns))
+    return hashlib.sha256("\n".join(stats).encode()).hexdigest()
+
+# Library namer for a library read from a .lib whose name doesn't follow
+# default_library_namer
+def liberty_library_namer(lib, corner):
+    return lib.name
+
+# Build a Library from one .lib file per corner: dotlibber's own output, or
+# any Liberty whose sequential arcs use the same constraint and delay
+# templates. Cells and pins come from the first file, each file adds its
+# corner and that corner's tables. cells limits the library to the named
+# (or globbed) cells, the others are skipped without being parsed;
+# corner_names and pins select as in Library. Files are read one
+# cell at a time and table values only when they are emitted (release them
+# with stream=True to keep memory bounded on large files).
+def read_liberty(paths, cells=None, bus_bits=None, cache=None, instrumentation=None, corner_names=None, pins=None):
+    if isinstance(paths, str):
+        paths = [paths]
+    tables = LibertyTables()
+    corner_attr = []
+    for i, path in enumerate(paths):
+        reader = LibertyReader(path)
+        with gc_paused():
+            header, corner, cell_attr, index, bits = read_liberty_file(reader, cells, i == 0)
+        if corner["name"] in tables.corners:
+            sys.stderr.write("Corner \"%s\" of %s was already read from %s. Aborting.\n" % (corner["name"], path, tables.corners[corner["name"]][0].path))
+            exit(1)
+        tables.corners[corner["name"]] = (reader, index)
+        corner_attr.append(corner)
+        if i == 0:
+            first = (header, cell_attr, bits)
+    header, cell_attr, bits = first
+    name = header.get("name")
+    library_namer = default_library_namer
+    suffix = "_" + corner_attr[0]["name"]
+    if name.endswith(suffix):
+        name = name[:-len(suffix)]
+    else:
+        library_namer = liberty_library_namer
+    revision = header.get("revision", "0")
+    lib_attr = {"name": name, "revision": int(revision) if revision.lstrip("-").isdigit() else revision, "cells": cell_attr}
+    options = {}
+    for k in ("delay_model", "simulation", "voltage_unit", "current_unit", "time_unit", "pulling_resistance_unit"):
+        if k in header:
+            options[k] = header[k]
+    if "capacitive_load_unit" in header:
+        options["capacitive_load_unit"] = "(%s)" % ", ".join(header["capacitive_load_unit"])
+    lib = Library(lib_attr, corner_attr, library_namer, tables, options, cache=cache, bus_bits=bits if bus_bits is None else bus_bits, instrumentation=instrumentation, corner_names=corner_names, pins=pins)
+    if "date" in header:
+        lib.datetime = header["date"]
+    return lib
+
+# One .lib for read_liberty. Returns the library level attributes, the
+# corner as corners JSON, the cells as library JSON (when cells is true),
+# the unloaded table groups by (cell, pin, direction, timing_type, related
+# pin, table), and whether buses were written bit by bit.
+def read_liberty_file(reader, wanted, cells):
+    def skip(type, args):
+        if type in LIBERTY_TABLES:
+            return True
+        return type == "cell" and wanted is not None and (not args or not name_selected(args[0], wanted))
+    reader.pos = 0
+    library = reader.open_group("library")
+    header = {"name": library.args[0] if library.args else ""}
+    voltage_map = {}
+    conditions = None
+    templates = {}
+    bus_types = {}
+    cell_attr = []
+    index = {}
+    bits = False
+    for name, value in reader.statements(library.start, skip):
+        if not isinstance(value, LibertyGroup):
+            if name == "voltage_map" and len(value) == 2:
+                voltage_map[value[0]] = float(value[1])
+            else:
+                header[name] = value
+        elif name == "operating_conditions" and conditions is None:
+            conditions = value
+        elif name == "lu_table_template":
+            templates[(value.get("variable_1"), value.get("variable_2"))] = value
+        elif name == "type" and value.args:
+            bus_types[value.args[0]] = value
+        elif name == "cell" and value.attrs is not None:
+            attr = liberty_cell(reader, value, bus_types, index)
+            bits = bits or attr.pop("bus_bits")
+            if cells:
+                cell_attr.append(attr)
+
+    if conditions is None:
+        reader.error("No operating_conditions group")
+    corner = {
+        "name": conditions.args[0] if conditions.args else header.get("default_operating_conditions"),
+        "process": int(float(header.get("nom_process", conditions.get("process", "1")))),
+        "temperature": int(float(header.get("nom_temperature", conditions.get("temperature", "25")))),
+        "nominal_voltage": float(header.get("nom_voltage", conditions.get("voltage", "0"))),
+        "voltage_map": voltage_map
+    }
+    for key, (var1, var2) in TEMPLATE_VARIABLES.items():
+        t = templates.get((var1, var2))
+        if t is None:
+            reader.error("No lu_table_template over %s and %s" % (var1, var2))
+        corner[key] = {var1: liberty_floats(t.get("index_1")[0]), var2: liberty_floats(t.get("index_2")[0])}
+    return header, corner, cell_attr, index, bits
+
+# Declare the arcs of a pin's timing groups in its library JSON: as a
+# sequential pin when they are exactly the arcs one expands to (see
+# Pin.declared_arcs), as a "timing" list otherwise
+def liberty_arcs(pin, timing):
+    arcs = [(t.get("timing_type"), t.get("related_pin"), t.get("timing_sense") or "non_unate") for t in timing]
+    clocks = []
+    for timing_type, related_pin, sense in arcs:
+        if related_pin not in clocks:
+            clocks.append(related_pin)
+    for edge, edges in CLOCK_EDGES.items():
+        expected = [(c.TIMING_TYPE, clock, "non_unate") for clock in clocks for e in edges for c in SEQUENTIAL_ARC_CLASSES.get((pin.get("direction"), e), [])]
+        if [(t, r, s if LIBERTY_ARC_CLASSES[t].TEMPLATE == "delay_template" else "non_unate") for t, r, s in arcs] == expected:
+            pin["sequential"] = True
+            pin["related_clock"] = clocks[0] if len(clocks) == 1 else clocks
+            if edge != "rising":
+                pin["clock_edge"] = edge
+            return
+    pin["timing"] = []
+    for timing_type, related_pin, sense in arcs:
+        entry = {"timing_type": timing_type, "related_pin": related_pin}
+        if LIBERTY_ARC_CLASSES[timing_type].TEMPLATE == "delay_template":
+            entry["timing_sense"] = sense
+        pin["timing"].append(entry)
+
+def liberty_cell(reader, group, bus_types, index):
+    attr = {"name": group.args[0], "pg_pins": [], "pins": [], "bus_bits": False}
+    for g in group.groups:
+        if g.type == "pg_pin":
+            attr["pg_pins"].append({"name": g.args[0], "pg_type": g.get("pg_type")})
+        elif g.type == "pin" or g.type == "bus":
+            pin = {"name": g.args[0]}
+            for name, value in g.attrs:
+                if name in ("capacitance", "max_transition", "max_capacitance"):
+                    pin[name] = float(value)
+                elif name in ("clock", "is_analog"):
+                    pin[name] = value == "true"
+                elif name in ("direction", "related_power_pin", "related_ground_pin"):
+                    pin[name] = value
+            timing = [t for t in g.groups if t.type == "timing"]
+            if g.type == "bus":
+                bus_type = bus_types.get(g.get("bus_type"))
+                if bus_type is None:
+                    reader.error("Unknown bus_type of bus \"%s\" in cell \"%s\"" % (g.args[0], attr["name"]))
+                a = int(bus_type.get("bit_from"))
+                b = int(bus_type.get("bit_to"))
+                pin["is_bus"] = True
+                pin["bus_max"] = max(a, b)
+                pin["bus_min"] = min(a, b)
+                # Power pins are on the pin groups inside the bus, and with
+                # per-bit groups so are the (shared) timing groups
+                for bit in [p for p in g.groups if p.type == "pin"][:1]:
+                    for k in ("related_power_pin", "related_ground_pin"):
+                        if bit.get(k) is not None:
+                            pin[k] = bit.get(k)
+                    if BUS_RE.match(bit.args[0]) is None:
+                        attr["bus_bits"] = True
+                        timing = timing or [t for t in bit.groups if t.type == "timing"]
+            timing = [t for t in timing if t.get("timing_type") in LIBERTY_ARC_CLASSES]
+            if timing:
+                liberty_arcs(pin, timing)
+            for t in timing:
+                for table in t.groups:
+                    index[(attr["name"], pin["name"], pin.get("direction"), t.get("timing_type"), t.get("related_pin"), table.type)] = table
+            attr["pins"].append(pin)
+    return attr
+
+# Binary library format, to emit a characterized library later or in
+# another process without characterizing it again:
+#
+#   BINARY_MAGIC
+#   BINARY_HEADER  offset and size of each section below
+#   meta           JSON: library and corner attributes, options, the library
+#                  name of each corner, date, bus_bits and byte order
+#   values         every table's values as float64, 8 byte aligned
+#   strings        JSON list, the string table the records index
+#   records        int64 x 9 per table: corner, cell, pin, direction, timing
+#                  type, related pin and table name as string ids, then the
+#                  offset and count of its values. Tables shared between
+#                  arcs are stored once.
+#
+# read_binary maps the file and hands out table values as memoryviews into
+# it, so loading costs no more than building the cells.
+BINARY_MAGIC = b"DOTLIB\x00\x02"
+BINARY_HEADER = struct.Struct("<8Q")
+
+def write_binary(lib, path, stream=False):
+    strings = {}
+    def sid(s):
+        if s not in strings:
+            strings[s] = len(strings)
+        return strings[s]
+    # Saved tables are final, derived and resampled corners load as plain ones
+    corner_attr = [dict((k, v) for k, v in c.attr.items() if k not in ("derive", "characterization_templates")) for c in lib.corners]
+    meta = json.dumps({
+        # Only the selected cells, and the pin patterns, have tables
+        "library": dict(lib.attr, cells=[c.attr for c in lib.cells]),
+        "pins": lib.pin_patterns,
+        "corners": corner_attr,
+        "options": lib.options,
+        "names": dict((c.name, lib.library_namer(lib, c)) for c in lib.corners),
+        "date": lib.datetime,
+        "bus_bits": lib.bus_bits,
+        "float_format": lib.float_format.spec,
+        "share_arcs": lib.share_arcs,
+        "byteorder": sys.byteorder
+    }).encode()
+    records = array.array("q")
+    count = 0
+    # id of a shared DataTable -> (table, offset), kept alive until written
+    written = {}
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as fp:
+        fp.write(BINARY_MAGIC + BINARY_HEADER.pack(*[0] * 8))
+        meta_offset = fp.tell()
+        fp.write(meta)
+        fp.write(b"\0" * (-fp.tell() % 8))
+        values_offset = fp.tell()
+        for corner in lib.corners:
+            if lib.characterized_up_front(corner):
+                lib.characterize(corner)
+            for cell in lib.cells:
+                # Unselected pins too, when selected ones share their tables
+                for pin in cell.with_representatives(cell.arc_pins):
+                    for arc in pin.get_arcs(corner):
+                        for name in arc.TABLES:
+                            table = getattr(arc, name)
+                            if id(table) in written:
+                                offset = written[id(table)][1]
+                            else:
+                                offset = count
+                                written[id(table)] = (table, offset)
+                                fp.write(table.values)
+                                count += len(table.values)
+                            records.extend((sid(corner.name), sid(cell.name), sid(pin.name), sid(pin.direction), sid(arc.TIMING_TYPE), sid(arc.related_pin.name), sid(name), offset, len(table.values)))
+                written.clear()
+                if stream:
+                    cell.release(corner)
+                    for s in corner.ancestors():
+                        cell.release(s)
+        strings_offset = fp.tell()
+        string_table = json.dumps(sorted(strings, key=strings.get)).encode()
+        fp.write(string_table)
+        fp.write(b"\0" * (-fp.tell() % 8))
+        records_offset = fp.tell()
+        fp.write(records)
+        fp.seek(len(BINARY_MAGIC))
+        fp.write(BINARY_HEADER.pack(meta_offset, len(meta), values_offset, count, strings_offset, len(string_table), records_offset, len(records) // 9))
+    os.replace(tmp, path)
+
+# The tables of a binary library file, replayed as a batch characterizer
+class BinaryTables:
+
+    batch = "list"
+
+    def __init__(self, path):
+        self.path = path
+        self.open()
+
+    def open(self):
+        with open(self.path, "rb") as fp:
+            try:
+                self.buf = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                self.buf = b""
+        if self.buf[:len(BINARY_MAGIC)] != BINARY_MAGIC:
+            sys.stderr.write("%s is not a dotlibber binary library. Aborting.\n" % self.path)
+            exit(1)
+        meta_offset, meta_size, values_offset, values_count, strings_offset, strings_size, records_offset, records_count = BINARY_HEADER.unpack_from(self.buf, len(BINARY_MAGIC))
+        self.meta = json.loads(self.buf[meta_offset:meta_offset + meta_size])
+        strings = json.loads(self.buf[strings_offset:strings_offset + strings_size])
+        view = memoryview(self.buf)
+        values = view[values_offset:values_offset + 8 * values_count].cast("d")
+        records = view[records_offset:records_offset + 72 * records_count].cast("q")
+        if self.meta["byteorder"] != sys.byteorder:
+            values = array.array("d", values.tobytes())
+            values.byteswap()
+            values = memoryview(values)
+            records = array.array("q", records.tobytes())
+            records.byteswap()
+        self.values = values
+        # (corner, cell, pin, direction, timing_type, related pin, table) -> (offset, count)
+        self.index = {}
+        columns = [records[j::9].tolist() for j in range(9)]
+        for r in zip(*columns):
+            self.index[(strings[r[0]], strings[r[1]], strings[r[2]], strings[r[3]], strings[r[4]], strings[r[5]], strings[r[6]])] = (r[7], r[8])
+
+    @property
+    def version(self):
+        return files_version([self.path])
+
+    # mmaps don't pickle, a copy handed to another process maps the file again
+    def __getstate__(self):
+        return {"path": self.path}
+
+    def __setstate__(self, state):
+        self.path = state["path"]
+        self.open()
+
+    def __call__(self, arc_type, timing_type, pin, related_pin, corner, params):
+        entry = self.index.get((corner.name, pin.cell.name, pin.name, pin.direction, timing_type, related_pin.name, arc_type))
+        if entry is None:
+            sys.stderr.write("%s has no %s %s table for pin \"%s\" of cell \"%s\" in corner \"%s\". Aborting.\n" % (self.path, timing_type, arc_type, pin.name, pin.cell.name, corner.name))
+            exit(1)
+        offset, count = entry
+        return self.values[offset:offset + count]
+
+# Library namer of a library read back with read_binary
+def stored_library_namer(names, lib, corner):
+    return names[corner.name]
+
+# Read a library written by Library.save. Its tables are views into the
+# mapped file, nothing is characterized again.
+def read_binary(path, cache=None, instrumentation=None):
+    tables = BinaryTables(path)
+    meta = tables.meta
+    with gc_paused():
+        lib = Library(meta["library"], meta["corners"], functools.partial(stored_library_namer, meta["names"]), tables, meta["options"], cache=cache, bus_bits=meta["bus_bits"], instrumentation=instrumentation, float_format=meta.get("float_format"), pins=meta.get("pins"), share_arcs=meta.get("share_arcs", False))
+    lib.datetime = meta["date"]
+    return lib
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate one .lib per corner from a library JSON description.")
+    parser.add_argument("library", nargs="+", help="library JSON file; with several, all are generated against the same corners and their throughput reported")
+    parser.add_argument("corners", help="corners JSON file")
+    parser.add_argument("-o", "--output-dir", default=None, help="directory for the generated .lib files (default: ./output next to dotlibber)")
+    parser.add_argument("-j", "--workers", type=int, default=1, help="number of corners to emit in parallel (0 = one per CPU)")
+    parser.add_argument("--bus-bits", action="store_true", help="emit a pin group per bit inside each bus group")
+    parser.add_argument("--stream", action="store_true", help="drop each cell's tables once it is written, so memory does not grow with the number of corners (derived corners characterize their sources again, use --cache)")
+    parser.add_argument("--incremental", choices=["corners", "cells"], default=None, help="only rewrite corners (or cells) whose inputs changed since the last run")
+    parser.add_argument("--compress", choices=["gzip", "zstd"], default=None, help="write compressed .lib.gz or .lib.zst files (zstd needs the zstandard package)")
+    parser.add_argument("--compress-level", type=int, default=None, help="compression level (gzip 1-9, default 9; zstd 1-22, default 3)")
+    parser.add_argument("--trace", default=None, help="write a Chrome trace of characterization and emission to this file")
+    parser.add_argument("--summary", default=None, help="write per phase/corner/cell/arc timing totals to this JSON file")
+    parser.add_argument("--characterize-workers", type=int, default=None, help="characterize the tables of a corner in this many threads or processes")
+    parser.add_argument("--characterize-pool", choices=["thread", "process"], default="thread", help="pool used with --characterize-workers (default: thread)")
+    parser.add_argument("--concurrency", type=int, default=16, help="characterizer calls in flight at once for async characterizers")
+    parser.add_argument("--cache", default=None, help="SQLite file used to cache characterized tables between runs")
+    parser.add_argument("--cache-size", type=float, default=None, help="evict least recently used cache entries beyond this many MB")
+    parser.add_argument("--cache-version", default=None, help="characterizer version; cached tables from other versions are dropped")
+    parser.add_argument("--cell", action="append", default=None, help="only generate cells matching this name or glob (repeatable)")
+    parser.add_argument("--corner", action="append", default=None, help="only write corners matching this name or glob (repeatable)")
+    parser.add_argument("--pin", action="append", default=None, help="only characterize and emit pins matching this name or glob (repeatable)")
+    parser.add_argument("--float-format", default=None, help="printf style format of table values, e.g. %%.6g, or a number of significant digits (default: shortest exact repr)")
+    parser.add_argument("--share-arcs", action="store_true", help="characterize arcs of pins with the same attributes once and share their tables")
+    args = parser.parse_args(argv)
+
+    cache = None
+    if args.cache is not None:
+        max_bytes = None if args.cache_size is None else int(args.cache_size * 1e6)
+        cache = CharacterizationCache(args.cache, max_bytes, args.cache_version)
+    instrumentation = None
+    if args.trace is not None or args.summary is not None:
+        instrumentation = Instrumentation(args.trace, args.summary)
+    if len(args.library) > 1 and args.characterize_workers is not None and args.characterize_pool == "process":
+        sys.stderr.write("Error: --characterize-pool process needs a single library, use thread. Aborting.\n")
+        exit(1)
+    libs = read_library_batch(args.library, args.corners, cache=cache, bus_bits=args.bus_bits, workers=args.workers or None, instrumentation=instrumentation, concurrency=args.concurrency, cells=args.cell, corner_names=args.corner, pins=args.pin)
+    file_namer = default_file_namer
+    if args.output_dir is not None:
+        file_namer = functools.partial(output_dir_file_namer, args.output_dir)
+    incremental = {None: False, "corners": True, "cells": "cells"}[args.incremental]
+    float_format = None
+    if args.float_format is not None:
+        float_format = FloatFormat(args.float_format)
+    executor = None
+    if args.characterize_workers is not None:
+        if args.characterize_pool == "process":
+            executor = characterization_process_pool(libs[0], args.characterize_workers or None)
+        else:
+            executor = concurrent.futures.ThreadPoolExecutor(args.characterize_workers or None)
+    for lib in libs:
+        lib.executor = executor
+        if float_format is not None:
+            lib.float_format = float_format
+        lib.share_arcs = args.share_arcs
+    try:
+        stats = write_libraries(libs, file_namer, workers=args.workers or None, stream=args.stream, incremental=incremental, compression=args.compress, compression_level=args.compress_level)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    if len(libs) > 1:
+        report_throughput(stats)
+
+if __name__ == "__main__":
+    main()
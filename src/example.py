@@ -2,7 +2,6 @@
 
 import os
 import sys
-import shutil
 here = os.path.dirname(os.path.abspath(__file__))
 
 # You may need to append your python path to be able to import dotlibber
@@ -14,9 +13,6 @@ libdir = os.path.join(os.path.dirname(here),"output")
 def file_namer(lib, corner):
     return os.path.join(libdir, dotlibber.default_library_namer(lib, corner) + ".lib")
 
-try:
-    shutil.rmtree(libdir)
-except:
-    pass
-
-dotlibber.read_library_json("../conf/test.json", "../conf/corners.json").write_all(file_namer)
+# Only corners whose inputs changed since the last run are rewritten. Delete
+# the output directory (or pass incremental=False) to force a full rebuild.
+dotlibber.read_library_json("../conf/test.json", "../conf/corners.json").write_all(file_namer, incremental=True)